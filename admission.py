@@ -0,0 +1,167 @@
+"""
+Admission control for print submissions.
+
+`print_document` asks `admission.admit()` before touching the database. A
+submission is rejected with 429 and a Retry-After when:
+
+- the process is over ADMISSION_RATE_PER_SECOND submissions (token bucket,
+  bursts of ADMISSION_BURST), Retry-After being the wait for the next token;
+- the student already has ADMISSION_MAX_JOBS_PER_STUDENT jobs in flight,
+  Retry-After being the estimated completion of their earliest job;
+- the printer would hold more than ADMISSION_MAX_QUEUED_PAGES pages, Retry-After
+  being the estimated time to print the excess at the printer's throughput.
+
+Every limit defaults to 0, which disables it. The checks read in-memory
+counters: queued pages come from the scheduler, and admitted pages are reserved
+until the job reaches it, so concurrent submissions cannot overshoot. While the
+per-student limit is set, jobs in flight are counted from submission until the
+event bus reports them COMPLETE, CANCELLED or DELETED. With several API
+processes, run the event bus on the change stream (JOB_EVENTS_CHANGE_STREAM=1)
+so jobs finished by another process are seen; an entry is dropped anyway
+ADMISSION_INFLIGHT_GRACE_SECONDS after the job's estimated completion. The
+rate limit applies per process.
+"""
+import math
+import os
+import time
+from datetime import datetime
+from events import event_bus
+from metrics import ADMISSION_REJECTIONS
+from scheduler import printer_scheduler
+from utils import now_utc
+
+ADMISSION_MAX_QUEUED_PAGES = int(os.getenv("ADMISSION_MAX_QUEUED_PAGES", "0"))
+ADMISSION_MAX_JOBS_PER_STUDENT = int(os.getenv("ADMISSION_MAX_JOBS_PER_STUDENT", "0"))
+ADMISSION_RATE_PER_SECOND = float(os.getenv("ADMISSION_RATE_PER_SECOND", "0"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", str(max(1.0, 2 * ADMISSION_RATE_PER_SECOND))))
+ADMISSION_INFLIGHT_GRACE_SECONDS = float(os.getenv("ADMISSION_INFLIGHT_GRACE_SECONDS", "600"))
+
+FINISHED_STATUSES = {"COMPLETE", "CANCELLED", "DELETED"}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, message: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Admission:
+    """
+    A submission let through, holding its reservations until it is queued or abandoned.
+    """
+    def __init__(self, student_id: str, printer: str, pages: int):
+        self.student_id = student_id
+        self.printer = printer
+        self.pages = pages
+        self.key = object()  # Stands in for the job in the student's in-flight entries until it is stored
+
+
+class AdmissionController:
+    def __init__(self):
+        self.tokens = ADMISSION_BURST
+        self.refilled_at = time.monotonic()
+        self.reserved_pages = {}  # printer name -> pages admitted but not yet handed to the scheduler
+        self.in_flight = {}       # studentId -> {fileId (or admission key): monotonic expiry}
+
+    def admit(self, student_id: str, printer: str, pages: int) -> Admission:
+        """
+        Check every limit and reserve a slot for the submission, or raise AdmissionRejected.
+        """
+        now = time.monotonic()
+        try:
+            self._check_rate(now)
+            self._check_student(student_id, now)
+            self._check_printer(printer, pages)
+        except AdmissionRejected as e:
+            ADMISSION_REJECTIONS.labels(e.reason).inc()
+            raise
+        if ADMISSION_RATE_PER_SECOND > 0:
+            self.tokens -= 1
+        admission = Admission(student_id, printer, pages)
+        self.reserved_pages[printer] = self.reserved_pages.get(printer, 0) + pages
+        if ADMISSION_MAX_JOBS_PER_STUDENT > 0:
+            self.in_flight.setdefault(student_id, {})[admission.key] = math.inf
+        return admission
+
+    def queued(self, admission: Admission, job: dict):
+        """
+        The job was stored and handed to the scheduler, which now counts its pages.
+        """
+        self._release_pages(admission)
+        if ADMISSION_MAX_JOBS_PER_STUDENT <= 0:
+            # Without the per-student limit nothing reads the in-flight entries
+            self._forget(admission.student_id, admission.key)
+            return
+        now = time.monotonic()
+        self._live_jobs(admission.student_id, now)  # Drop expired entries before adding one
+        jobs = self.in_flight.setdefault(admission.student_id, {})
+        jobs.pop(admission.key, None)
+        expected = job.get("expected_time")
+        seconds_left = (expected - now_utc()).total_seconds() if isinstance(expected, datetime) else 0
+        jobs[job["fileId"]] = now + max(0.0, seconds_left) + ADMISSION_INFLIGHT_GRACE_SECONDS
+
+    def abandon(self, admission: Admission):
+        """
+        The submission failed before its job was queued; give its slot back.
+        """
+        self._release_pages(admission)
+        self._forget(admission.student_id, admission.key)
+
+    def job_changed(self, event: dict):
+        # Event bus listener: finished jobs leave the student's in-flight count
+        if event.get("status") in FINISHED_STATUSES:
+            self._forget(event.get("studentId"), event.get("fileId"))
+
+    def _check_rate(self, now: float):
+        if ADMISSION_RATE_PER_SECOND <= 0:
+            return
+        self.tokens = min(ADMISSION_BURST, self.tokens + (now - self.refilled_at) * ADMISSION_RATE_PER_SECOND)
+        self.refilled_at = now
+        if self.tokens < 1:
+            raise AdmissionRejected("rate", "Too many print submissions, please retry shortly.",
+                                    (1 - self.tokens) / ADMISSION_RATE_PER_SECOND)
+
+    def _check_student(self, student_id: str, now: float):
+        if ADMISSION_MAX_JOBS_PER_STUDENT <= 0:
+            return
+        jobs = self._live_jobs(student_id, now)
+        if len(jobs) >= ADMISSION_MAX_JOBS_PER_STUDENT:
+            earliest = min(jobs.values()) - ADMISSION_INFLIGHT_GRACE_SECONDS
+            raise AdmissionRejected("student", f"You already have {len(jobs)} print jobs in progress.",
+                                    earliest - now if earliest != math.inf else 0)
+
+    def _check_printer(self, printer: str, pages: int):
+        if ADMISSION_MAX_QUEUED_PAGES <= 0:
+            return
+        queued = printer_scheduler.pending_pages(printer) + self.reserved_pages.get(printer, 0)
+        # A job larger than the limit is still accepted by an idle printer
+        excess = queued + pages - ADMISSION_MAX_QUEUED_PAGES
+        if queued > 0 and excess > 0:
+            raise AdmissionRejected("printer", f"Printer {printer} has too many pages queued.",
+                                    printer_scheduler.seconds_to_print(printer, min(excess, queued)))
+
+    def _live_jobs(self, student_id: str, now: float) -> dict:
+        jobs = self.in_flight.get(student_id, {})
+        for key in [key for key, expires in jobs.items() if expires < now]:
+            del jobs[key]
+        return jobs
+
+    def _forget(self, student_id, key):
+        jobs = self.in_flight.get(student_id)
+        if jobs is None:
+            return
+        jobs.pop(key, None)
+        if not jobs:
+            del self.in_flight[student_id]
+
+    def _release_pages(self, admission: Admission):
+        remaining = self.reserved_pages.get(admission.printer, 0) - admission.pages
+        if remaining > 0:
+            self.reserved_pages[admission.printer] = remaining
+        else:
+            self.reserved_pages.pop(admission.printer, None)
+
+
+admission = AdmissionController()
+event_bus.add_listener(admission.job_changed)
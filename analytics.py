@@ -0,0 +1,172 @@
+"""
+Pre-aggregated printing statistics for the admin dashboard.
+
+`printing_rollups` holds one document per (granularity, bucket, printer,
+faculty) with running totals of pages, copies and jobs, for hourly and daily
+buckets aligned to UTC+7. The scheduler updates both buckets incrementally as
+each job completes, so dashboard queries read a handful of rollup documents
+instead of scanning admin_printing_history.
+
+Regenerate the rollups from raw history (e.g. after migrating timestamps):
+
+    python analytics.py --rebuild
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from utils import timezone_utc_plus_7
+
+GRANULARITIES = ("hour", "day")
+GROUP_FIELDS = {"printer": "$printer", "area": "$area", "faculty": "$faculty", "hour": "$bucket", "day": "$bucket"}
+PERIODS = ("today", "this_week", "this_month", "this_year")
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    """
+    Start of the UTC+7 hour or day containing `moment`, as a UTC datetime.
+    """
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    local = moment.astimezone(timezone_utc_plus_7).replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    if granularity == "day":
+        local = local.replace(hour=0)
+    return timezone_utc_plus_7.localize(local).astimezone(timezone.utc)
+
+
+def period_range(period: str, now: datetime):
+    """
+    [start, end) of a named calendar period in UTC+7.
+    """
+    local = now.astimezone(timezone_utc_plus_7).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    if period == "today":
+        start = local
+    elif period == "this_week":
+        start = local - timedelta(days=local.weekday())
+    elif period == "this_month":
+        start = local.replace(day=1)
+    elif period == "this_year":
+        start = local.replace(month=1, day=1)
+    else:
+        raise ValueError(f"Unknown period {period!r}")
+    return timezone_utc_plus_7.localize(start).astimezone(timezone.utc), now
+
+
+def rollup_updates(job: dict, completed_at: datetime) -> list:
+    """
+    Upserts adding one completed job to its hourly and daily rollups.
+    """
+    updates = []
+    for granularity in GRANULARITIES:
+        key = {
+            "granularity": granularity,
+            "bucket": bucket_start(completed_at, granularity),
+            "printer": job["printer"],
+            "faculty": job.get("faculty") or "Unknown",
+        }
+        updates.append(UpdateOne(
+            key,
+            {"$set": {"area": job["area"]}, "$inc": {"pages": job["pages"], "copies": job["copies"], "jobs": 1}},
+            upsert=True,
+        ))
+    return updates
+
+
+async def record_completed_jobs(db, completions: list, session=None):
+    """
+    Add (job, completed_at) pairs to their rollups in one bulk write.
+    """
+    updates = [update for job, completed_at in completions for update in rollup_updates(job, completed_at)]
+    if updates:
+        await db["printing_rollups"].bulk_write(updates, ordered=False, session=session)
+
+
+def _is_aligned(moment: datetime) -> bool:
+    return bucket_start(moment, "day") == moment.astimezone(timezone.utc)
+
+
+async def rollup_stats(db, group_by: str, start: datetime, end: datetime, filters: dict = None) -> list:
+    """
+    Totals per `group_by` key over [start, end), read from the rollups.
+    Daily buckets are used when the range is day-aligned, hourly ones otherwise.
+    """
+    granularity = "day" if group_by == "day" or (group_by != "hour" and _is_aligned(start) and _is_aligned(end)) else "hour"
+    match = {"granularity": granularity, "bucket": {"$gte": bucket_start(start, granularity), "$lt": end}}
+    match.update(filters or {})
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": GROUP_FIELDS[group_by],
+            "pages": {"$sum": "$pages"},
+            "copies": {"$sum": "$copies"},
+            "jobs": {"$sum": "$jobs"},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "key": "$_id", "pages": 1, "copies": 1, "jobs": 1}},
+    ]
+    return await (await db["printing_rollups"].aggregate(pipeline)).to_list()
+
+
+async def rebuild_rollups(db) -> int:
+    """
+    Regenerate every rollup from admin_printing_history. Returns the number of rollup documents.
+    """
+    await db["printing_rollups"].delete_many({})
+    for granularity in GRANULARITIES:
+        pipeline = [
+            {"$match": {"time": {"$type": "date"}}},
+            # History written before faculty was recorded gets it from the student profile
+            {"$lookup": {"from": "students", "localField": "studentId", "foreignField": "studentId",
+                         "pipeline": [{"$project": {"_id": 0, "faculty": 1}}], "as": "student"}},
+            {"$group": {
+                "_id": {
+                    "bucket": {"$dateTrunc": {"date": "$time", "unit": granularity, "timezone": "Asia/Bangkok"}},
+                    "printer": "$printer",
+                    "faculty": {"$ifNull": ["$faculty", {"$ifNull": [{"$first": "$student.faculty"}, "Unknown"]}]},
+                },
+                "area": {"$first": "$area"},
+                "pages": {"$sum": "$pages"},
+                "copies": {"$sum": "$copies"},
+                "jobs": {"$sum": 1},
+            }},
+            {"$project": {
+                "_id": 0, "granularity": {"$literal": granularity}, "bucket": "$_id.bucket",
+                "printer": "$_id.printer", "faculty": "$_id.faculty",
+                "area": 1, "pages": 1, "copies": 1, "jobs": 1,
+            }},
+            {"$merge": {"into": "printing_rollups", "on": ["granularity", "bucket", "printer", "faculty"],
+                        "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]
+        await (await db["admin_printing_history"].aggregate(pipeline)).to_list()
+    rebuilt = await db["printing_rollups"].count_documents({})
+    logger.info("Rebuilt printing rollups", extra={"documents": rebuilt})
+    return rebuilt
+
+
+async def main():
+    from database import connect_to_database, close_database_connection
+    from indexes import ensure_indexes
+    from logs import configure_logging
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the rollups from raw history")
+    args = parser.parse_args()
+
+    configure_logging()
+    db = await connect_to_database()
+    try:
+        if args.rebuild:
+            # $merge needs the unique index on its "on" fields
+            await ensure_indexes(db)
+            print(f"Rebuilt {await rebuild_rollups(db)} rollup documents")
+        else:
+            parser.print_help()
+    finally:
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+"""
+Background archival of finished print jobs.
+
+`waiting_sessions` should only hold in-flight work. Every
+ARCHIVE_INTERVAL_SECONDS the archiver moves COMPLETE jobs that finished more
+than ARCHIVE_GRACE_MINUTES ago into `waiting_sessions_archive`, and deletes
+CANCELLED jobs no worker has cleaned up within the same grace period. Either
+way the job's reference on its stored document is released. Each pass then
+deletes stored documents left unreferenced past DOCUMENT_GC_GRACE_HOURS.
+Archived jobs expire through a TTL index after ARCHIVE_RETENTION_DAYS; the
+permanent record of a print is `printing_history`.
+
+Every API process runs the archiver. Each job is copied with an idempotent
+upsert and removed with a conditional delete, so concurrent passes never lose
+a job or release its document twice. Run one pass by hand with:
+
+    python archiver.py
+"""
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from pymongo import ReplaceOne
+from database import get_database, get_gridfs
+from documents import collect_unreferenced_documents, release_document
+from utils import now_utc
+
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "300"))  # 0 disables the archiver
+ARCHIVE_GRACE = timedelta(minutes=float(os.getenv("ARCHIVE_GRACE_MINUTES", "60")))
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+async def archive_completed_jobs(db, fs, cutoff) -> int:
+    """
+    Move COMPLETE jobs finished before `cutoff` to waiting_sessions_archive.
+    """
+    archived = 0
+    while True:
+        jobs = await db["waiting_sessions"].find(
+            {"status": "COMPLETE", "completion_time": {"$lt": cutoff}}
+        ).limit(ARCHIVE_BATCH_SIZE).to_list()
+        if not jobs:
+            return archived
+        archived_at = now_utc()
+        await db["waiting_sessions_archive"].bulk_write(
+            [ReplaceOne({"_id": job["_id"]}, {**job, "archivedAt": archived_at}, upsert=True) for job in jobs],
+            ordered=False,
+        )
+        for job in jobs:
+            # Only the pass that removes the job releases its document
+            result = await db["waiting_sessions"].delete_one({"_id": job["_id"], "status": "COMPLETE"})
+            if result.deleted_count:
+                archived += 1
+                if job.get("documentHash"):
+                    await release_document(db, fs, job["documentHash"])
+        if len(jobs) < ARCHIVE_BATCH_SIZE:
+            return archived
+
+
+async def purge_cancelled_jobs(db, fs, cutoff) -> int:
+    """
+    Delete CANCELLED jobs older than `cutoff` that no printer worker has discarded.
+    """
+    purged = 0
+    stale = {"status": "CANCELLED", "$or": [
+        {"cancelled_at": {"$lt": cutoff}},
+        # Jobs cancelled before the cancellation time was recorded
+        {"cancelled_at": {"$exists": False}, "submission_time": {"$lt": cutoff}},
+    ]}
+    async for job in db["waiting_sessions"].find(stale, {"_id": 1, "documentHash": 1}):
+        result = await db["waiting_sessions"].delete_one({"_id": job["_id"], "status": "CANCELLED"})
+        if result.deleted_count:
+            purged += 1
+            if job.get("documentHash"):
+                await release_document(db, fs, job["documentHash"])
+    return purged
+
+
+async def archive_once(db, fs) -> dict:
+    cutoff = now_utc() - ARCHIVE_GRACE
+    result = {
+        "archived": await archive_completed_jobs(db, fs, cutoff),
+        "purged": await purge_cancelled_jobs(db, fs, cutoff),
+        "collected": await collect_unreferenced_documents(db, fs),
+    }
+    if any(result.values()):
+        logger.info("Archived finished jobs", extra=result)
+    return result
+
+
+class Archiver:
+    def __init__(self):
+        self.task = None
+
+    async def start(self):
+        if ARCHIVE_INTERVAL_SECONDS > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await archive_once(get_database(), get_gridfs())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Archiver pass failed")
+            await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+archiver = Archiver()
+
+
+async def main():
+    from database import connect_to_database, close_database_connection
+    from logs import configure_logging
+
+    configure_logging()
+    db = await connect_to_database()
+    try:
+        print(await archive_once(db, get_gridfs()))
+    finally:
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,349 @@
+"""
+Mixed-traffic benchmark of the main API routes.
+
+Seeds a database with realistic volumes (students, printing history, PDFs in
+GridFS), boots `main:app` under uvicorn against it and drives a weighted mix
+of print submissions, history browsing (following pagination cursors), queue
+polling and PDF fetches (whole and by Range) from --concurrency clients. For
+each route it reports throughput and p50/p95/p99 latency, and saves the run as
+JSON so later runs can be compared with --baseline.
+
+The database is either the one from .env (MONGO_URI / DATABASE_NAME, which is
+dropped when seeding: point it at a scratch database) or, with --mongod, a
+throwaway single-node replica set started from the given mongod binary. Its
+data directory lives in /dev/shm when available, so the whole dataset stays
+in memory and disappears afterwards.
+
+Usage:
+    python benchmarks/bench_endpoints.py --mongod mongod --students 20000 --history 1000000
+    python benchmarks/bench_endpoints.py --reuse --duration 60 --baseline benchmarks/results/last.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+from gridfs import GridFSBucket
+from pymongo import MongoClient
+
+import database
+from main import DEFAULT_PRINTERS
+
+FACULTIES = ["CSE", "EE", "ME", "CE", "CHE", "AS", "MT", "GEO"]
+SEED_BATCH = 10000
+SEED_MARKER = "bench_seed"
+
+# Relative frequency of each operation in the traffic mix
+TRAFFIC_MIX = {
+    "POST /user/print_document": 10,
+    "GET /user/printing_history": 25,
+    "GET /admin/printing_history": 10,
+    "GET /user/printer_queue": 15,
+    "GET /user/waiting_sessions": 10,
+    "GET /user/personal_information": 10,
+    "GET /user/get_pdf": 8,
+    "GET /user/get_pdf (range)": 7,
+    "GET /user/get_available_printers": 5,
+}
+
+
+def start_mongod(binary: str, port: int):
+    """
+    Start a single-node replica set (so transactions are available) on a scratch data directory.
+    """
+    parent = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    dbpath = tempfile.mkdtemp(prefix="bench-mongod-", dir=parent)
+    process = subprocess.Popen(
+        [binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--replSet", "bench",
+         "--quiet", "--logpath", os.path.join(dbpath, "mongod.log")],
+    )
+    client = MongoClient(f"mongodb://127.0.0.1:{port}/?directConnection=true", serverSelectionTimeoutMS=1000)
+    deadline = time.time() + 30
+    while True:
+        try:
+            client.admin.command("ping")
+            break
+        except Exception:
+            if time.time() > deadline or process.poll() is not None:
+                process.kill()
+                raise RuntimeError("mongod did not start")
+            time.sleep(0.2)
+    client.admin.command("replSetInitiate", {"_id": "bench", "members": [{"_id": 0, "host": f"127.0.0.1:{port}"}]})
+    while not client.admin.command("hello").get("isWritablePrimary"):
+        time.sleep(0.2)
+    client.close()
+    return process, dbpath, f"mongodb://127.0.0.1:{port}/?replicaSet=bench"
+
+
+def seed(db, students: int, history: int, pdfs: int, rng: random.Random) -> dict:
+    """
+    Drop the database and fill it with the benchmark dataset.
+    """
+    db.client.drop_database(db.name)
+    started = time.perf_counter()
+    student_ids = [f"S{i:07d}" for i in range(students)]
+    for offset in range(0, students, SEED_BATCH):
+        db["students"].insert_many([
+            {"name": f"Student {i}", "studentId": student_ids[i], "email": f"{student_ids[i]}@example.com",
+             "faculty": rng.choice(FACULTIES), "numberOfA4": 10 ** 9, "numberOfPrintedDocs": 0}
+            for i in range(offset, min(students, offset + SEED_BATCH))
+        ], ordered=False)
+
+    now = datetime.now(timezone.utc)
+    for offset in range(0, history, SEED_BATCH):
+        admin_rows, user_rows = [], []
+        for i in range(offset, min(history, offset + SEED_BATCH)):
+            student_id = rng.choice(student_ids)
+            printer = rng.choice(DEFAULT_PRINTERS)
+            copies = rng.choice([1, 1, 1, 2, 3])
+            row = {
+                "studentId": student_id,
+                "time": now - timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                "fileName": f"document-{i}.pdf",
+                "pages": rng.randint(1, 40) * copies,
+                "place": printer,
+                "printer": printer,
+                "copies": copies,
+            }
+            user_rows.append({**row, "fileId": str(i)})
+            admin_rows.append({**row, "studentName": f"Student {student_id}", "area": printer.split("-")[0],
+                               "faculty": rng.choice(FACULTIES)})
+        db["printing_history"].insert_many(user_rows, ordered=False)
+        db["admin_printing_history"].insert_many(admin_rows, ordered=False)
+
+    bucket = GridFSBucket(db)
+    file_ids = []
+    for i in range(pdfs):
+        size = rng.randint(100, 2048) * 1024
+        data = b"%PDF-1.4\n" + rng.randbytes(size)
+        file_ids.append(str(bucket.upload_from_stream(f"bench-{i}.pdf", data, metadata={"pages": 1})))
+
+    db[SEED_MARKER].insert_one({"students": students, "history": history, "fileIds": file_ids})
+    print(f"Seeded {students} students, {history} history rows and {pdfs} PDFs "
+          f"in {time.perf_counter() - started:.0f}s")
+    return db[SEED_MARKER].find_one()
+
+
+def start_app(port: int, uri: str, database_name: str, print_seconds: float):
+    env = dict(os.environ, MONGO_URI=uri, DATABASE_NAME=database_name, PRINT_SECONDS=str(print_seconds))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_up(client: httpx.AsyncClient, timeout: float):
+    # Startup builds the index manifest, which takes a while on a freshly seeded database
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            await client.get("/user/get_available_printers")
+            return
+        except httpx.HTTPError:
+            await asyncio.sleep(0.5)
+    raise RuntimeError("The API did not start")
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Traffic:
+    def __init__(self, client: httpx.AsyncClient, seeded: dict, rng: random.Random):
+        self.client = client
+        self.rng = rng
+        self.file_ids = seeded["fileIds"]
+        self.students = seeded["students"]
+        self.latencies = {route: [] for route in TRAFFIC_MIX}
+        self.statuses = {route: {} for route in TRAFFIC_MIX}
+
+    def student(self) -> dict:
+        return {"studentId": f"S{self.rng.randrange(self.students):07d}"}
+
+    async def request(self, route: str):
+        rng = self.rng
+        if route == "POST /user/print_document":
+            return await self.client.post("/user/print_document", headers=self.student(), json={
+                "fileName": "bench.pdf", "pages": rng.randint(1, 20), "copies": rng.choice([1, 1, 2]),
+                "printer": "auto", "area": rng.choice(DEFAULT_PRINTERS).split("-")[0],
+            })
+        if route == "GET /user/printing_history":
+            response = await self.client.get("/user/printing_history", params={"limit": 50, "order": "desc"},
+                                             headers=self.student())
+            # Some users page further back
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor and rng.random() < 0.3:
+                response = await self.client.get("/user/printing_history", params={"limit": 50, "cursor": cursor},
+                                                 headers=self.student())
+            return response
+        if route == "GET /admin/printing_history":
+            params = {"limit": 100, "order": "desc",
+                      "time_filter": rng.choice(["Since 1 day", "Since 1 week", "Since 1 month"])}
+            if rng.random() < 0.5:
+                params["area"] = rng.choice(DEFAULT_PRINTERS).split("-")[0]
+            return await self.client.get("/admin/printing_history", params=params)
+        if route == "GET /user/printer_queue":
+            return await self.client.get("/user/printer_queue", params={"printer": rng.choice(DEFAULT_PRINTERS)})
+        if route == "GET /user/waiting_sessions":
+            return await self.client.get("/user/waiting_sessions", headers=self.student())
+        if route == "GET /user/personal_information":
+            return await self.client.get("/user/personal_information", headers=self.student())
+        if route == "GET /user/get_pdf":
+            return await self.client.get(f"/user/get_pdf/{rng.choice(self.file_ids)}")
+        if route == "GET /user/get_pdf (range)":
+            start = rng.randrange(64 * 1024)
+            return await self.client.get(f"/user/get_pdf/{rng.choice(self.file_ids)}",
+                                         headers={"Range": f"bytes={start}-{start + 64 * 1024 - 1}"})
+        return await self.client.get("/user/get_available_printers")
+
+    async def worker(self, measure_from: float, deadline: float):
+        routes, weights = list(TRAFFIC_MIX), list(TRAFFIC_MIX.values())
+        while time.perf_counter() < deadline:
+            route = self.rng.choices(routes, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = (await self.request(route)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if start >= measure_from:
+                self.latencies[route].append(time.perf_counter() - start)
+                self.statuses[route][str(status)] = self.statuses[route].get(str(status), 0) + 1
+
+    def report(self, duration: float) -> dict:
+        routes = {}
+        for route, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            routes[route] = {
+                "requests": len(latencies),
+                "throughput_rps": round(len(latencies) / duration, 1),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "statuses": self.statuses[route],
+            }
+        return routes
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    """
+    Routes whose p95 grew by more than `max_regression` percent over the baseline run.
+    """
+    regressions = []
+    for route, stats in results["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if not before or not before["p95_ms"]:
+            continue
+        change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        print(f"{route:35} p95 {before['p95_ms']:9.2f} -> {stats['p95_ms']:9.2f} ms ({change:+.1f}%)")
+        if change > max_regression:
+            regressions.append(route)
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def drive(args, seeded: dict) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+        await wait_until_up(client, args.startup_timeout)
+        traffic = Traffic(client, seeded, random.Random(args.seed))
+        measure_from = time.perf_counter() + args.warmup
+        deadline = measure_from + args.duration
+        await asyncio.gather(*(traffic.worker(measure_from, deadline) for _ in range(args.concurrency)))
+        return traffic.report(args.duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongod", help="mongod binary to start a throwaway replica set with")
+    parser.add_argument("--mongod-port", type=int, default=27900)
+    parser.add_argument("--reuse", action="store_true", help="keep the previously seeded database")
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--history", type=int, default=1000000, help="rows in each history collection")
+    parser.add_argument("--pdfs", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of traffic before measuring")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--print-seconds", type=float, default=0.05, help="PRINT_SECONDS for the app")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="results file (default benchmarks/results/endpoints-<time>.json)")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=20, help="allowed p95 growth in percent")
+    args = parser.parse_args()
+
+    mongod = dbpath = None
+    uri, database_name = database.MONGO_URI, database.DATABASE_NAME
+    if args.mongod:
+        mongod, dbpath, uri = start_mongod(args.mongod, args.mongod_port)
+        database_name = database_name or "bench"
+    app = None
+    try:
+        db = MongoClient(uri)[database_name]
+        seeded = db[SEED_MARKER].find_one() if args.reuse else None
+        if seeded is None:
+            seeded = seed(db, args.students, args.history, args.pdfs, random.Random(args.seed))
+        # Leftover jobs from earlier runs would skew the queue routes
+        db["waiting_sessions"].delete_many({})
+        db.client.close()
+
+        app = start_app(args.port, uri, database_name, args.print_seconds)
+        routes = asyncio.run(drive(args, seeded))
+    finally:
+        if app:
+            app.kill()
+        if mongod:
+            mongod.kill()
+            mongod.wait()
+            shutil.rmtree(dbpath, ignore_errors=True)
+
+    results = {
+        "revision": git_revision(),
+        "startedAt": datetime.now(timezone.utc).isoformat(),
+        "dataset": {"students": seeded["students"], "history": seeded["history"], "pdfs": len(seeded["fileIds"])},
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "totalThroughputRps": round(sum(stats["requests"] for stats in routes.values()) / args.duration, 1),
+        "routes": routes,
+    }
+    for route, stats in routes.items():
+        print(f"{route:35} {stats['throughput_rps']:8.1f} req/s  p50 {stats['p50_ms']:8.2f}  "
+              f"p95 {stats['p95_ms']:8.2f}  p99 {stats['p99_ms']:8.2f} ms  {stats['statuses']}")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results",
+                                         f"endpoints-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print(f"p95 regressed by more than {args.max_regression}% on: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Latency and overdraw check for the print_document quota deduction.
+
+Compares the legacy sequence (find the student, check the balance, two
+separate $inc updates, insert the job) with deduct_pages_and_queue, which
+folds the check and both increments into one conditional find_one_and_update
+and inserts the job in the same transaction when the server supports it.
+
+Each mode fires --jobs concurrent submissions for a student whose balance
+only covers --affordable of them, then reports latency and whether the
+balance was overdrawn. Exits with status 1 if the atomic mode overdraws or
+queues a different number of jobs than it accepted. Runs against the MongoDB
+from .env; the benchmark student and its jobs are removed afterwards.
+
+Usage:
+    python benchmarks/bench_print_document.py --jobs 200 --affordable 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+
+import database
+from routers.user import deduct_pages_and_queue, generate_random_digits
+
+STUDENT_ID = "bench-print-document"
+PAGES = 2
+
+
+def make_job():
+    return {
+        "studentId": STUDENT_ID, "fileName": "bench.pdf", "fileId": generate_random_digits(),
+        "pages": PAGES, "printer": "bench", "place": "bench", "copies": 1, "area": "bench",
+        "status": "BENCH", "submission_time": "",
+    }
+
+
+async def legacy_submit(db):
+    student = await db["students"].find_one({"studentId": STUDENT_ID})
+    if student["numberOfA4"] < PAGES:
+        raise HTTPException(status_code=400, detail="Not enough A4 pages.")
+    await db["students"].update_one({"studentId": STUDENT_ID}, {"$inc": {"numberOfA4": -PAGES}})
+    await db["students"].update_one({"studentId": STUDENT_ID}, {"$inc": {"numberOfPrintedDocs": 1}})
+    job = make_job()
+    job["studentName"] = student["name"]
+    await db["waiting_sessions"].insert_one(job)
+
+
+async def atomic_submit(db):
+    await deduct_pages_and_queue(db, STUDENT_ID, PAGES, 1, make_job())
+
+
+async def run_mode(db, name, submit, jobs, affordable) -> dict:
+    await db["students"].delete_many({"studentId": STUDENT_ID})
+    await db["waiting_sessions"].delete_many({"studentId": STUDENT_ID})
+    await db["students"].insert_one({
+        "name": "Bench", "studentId": STUDENT_ID, "email": "", "faculty": "",
+        "numberOfA4": affordable * PAGES, "numberOfPrintedDocs": 0,
+    })
+
+    latencies = []
+
+    async def one():
+        start = time.perf_counter()
+        try:
+            await submit(db)
+            accepted = True
+        except HTTPException:
+            accepted = False
+        latencies.append(time.perf_counter() - start)
+        return accepted
+
+    accepted = sum(await asyncio.gather(*(one() for _ in range(jobs))))
+    student = await db["students"].find_one({"studentId": STUDENT_ID})
+    queued = await db["waiting_sessions"].count_documents({"studentId": STUDENT_ID})
+    latencies.sort()
+    result = {
+        "mode": name,
+        "accepted": accepted,
+        "queued": queued,
+        "final_balance": student["numberOfA4"],
+        "overdrawn": student["numberOfA4"] < 0 or accepted > affordable,
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+    print(result)
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--affordable", type=int, default=50)
+    args = parser.parse_args()
+
+    db = await database.connect_to_database()
+    print(f"transactions: {database.supports_transactions()}")
+    try:
+        await run_mode(db, "legacy", legacy_submit, args.jobs, args.affordable)
+        atomic = await run_mode(db, "atomic", atomic_submit, args.jobs, args.affordable)
+    finally:
+        await db["students"].delete_many({"studentId": STUDENT_ID})
+        await db["waiting_sessions"].delete_many({"studentId": STUDENT_ID})
+        await database.close_database_connection()
+    # The legacy sequence is expected to overdraw; the atomic one must not
+    if atomic["overdrawn"] or atomic["queued"] != atomic["accepted"]:
+        print("Atomic deduction overdrew the balance or lost jobs")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
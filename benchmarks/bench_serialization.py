@@ -0,0 +1,129 @@
+"""
+Serialization cost of a list response.
+
+Builds --rows admin printing-history rows as they come out of MongoDB and
+times turning them into a response body two ways:
+
+- model: the previous path. Fill in missing fields in Python, validate every
+  row against the PrintingHistory response model, dump it to JSON-compatible
+  data and render it with JSONResponse.
+- lean: the rows as the route's projection returns them, rendered by
+  MongoJSONResponse (orjson, datetimes formatted by the encoder).
+
+Needs no database.
+
+Usage:
+    python benchmarks/bench_serialization.py --rows 10000 --repeat 20
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from responses import MongoJSONResponse
+from schemas import PrintingHistory
+from utils import now_utc
+
+PRINTERS = [("Printer A1", "CS1"), ("Printer B4", "CS1"), ("Printer C2", "CS2"), ("Printer H6", "CS2")]
+
+
+def stored_rows(count: int) -> list:
+    """
+    Rows as stored in admin_printing_history. Some older rows lack docName,
+    studentName and copies, which the routes fill in.
+    """
+    start = now_utc()
+    rows = []
+    for i in range(count):
+        printer, area = random.choice(PRINTERS)
+        row = {
+            "fileName": f"report-{i}.pdf",
+            "time": start - timedelta(minutes=i),
+            "printer": printer,
+            "area": area,
+            "studentId": f"2{i % 20000:06d}",
+            "copy": random.randint(1, 3),
+        }
+        if i % 4:
+            row.update(docName=row["fileName"], studentName=f"Student {i % 20000}", copies=row["copy"])
+        rows.append(row)
+    return rows
+
+
+def projected_rows(rows: list) -> list:
+    """
+    What the PRINTING_HISTORY_PROJECTION returns for `rows`.
+    """
+    return [{
+        "docName": row.get("docName", row.get("fileName", "Unknown")),
+        "printTime": row.get("time", "Unknown"),
+        "studentName": row.get("studentName", row.get("studentId", "Unknown")),
+        "copies": row.get("copies", row.get("copy", 1)),
+        "printer": row["printer"],
+        "area": row["area"],
+        "studentId": row["studentId"],
+        "place": row.get("place", row.get("printer", "Unknown")),
+    } for row in rows]
+
+
+def model_path(rows: list, adapter: TypeAdapter) -> bytes:
+    rows = [dict(row) for row in rows]
+    for record in rows:
+        record.setdefault("docName", record.get("fileName", "Unknown"))
+        record.setdefault("printTime", record.get("time", "Unknown"))
+        record.setdefault("studentName", record.get("studentId", "Unknown"))
+        record.setdefault("copies", record.get("copy", 1))
+        record.setdefault("place", record.get("printer", "Unknown"))
+    content = adapter.dump_python(adapter.validate_python(rows), mode="json")
+    return JSONResponse(content).body
+
+
+def lean_path(rows: list) -> bytes:
+    return MongoJSONResponse(rows).body
+
+
+def timed(fn, repeat: int) -> list:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(7)
+    rows = stored_rows(args.rows)
+    projected = projected_rows(rows)
+    adapter = TypeAdapter(list[PrintingHistory])
+
+    if json.loads(model_path(rows, adapter)) != json.loads(lean_path(projected)):
+        sys.exit("The two paths render different bodies")
+
+    results = {
+        "model": timed(lambda: model_path(rows, adapter), args.repeat),
+        "lean": timed(lambda: lean_path(projected), args.repeat),
+    }
+    print(f"{args.rows} rows, {args.repeat} runs")
+    for name, samples in results.items():
+        print(f"{name:>6}: median {statistics.median(samples):8.2f} ms   min {min(samples):8.2f} ms")
+    speedup = statistics.median(results["model"]) / statistics.median(results["lean"])
+    print(f"speedup: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
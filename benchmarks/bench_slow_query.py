@@ -0,0 +1,101 @@
+"""
+Throughput of a fast route while another request is stuck in a slow query.
+
+Runs the app in-process against the MongoDB from .env (MONGO_URI / DATABASE_NAME)
+and compares two modes for the slow request:
+
+  blocking  the slow query goes through a synchronous MongoClient on the event
+            loop, which is how every handler used to talk to Mongo
+  async     the slow query goes through the shared async client from database.py
+
+The fast route is /user/waiting_sessions, which queries MongoDB on every
+request. The printer routes are served from the in-memory printer cache and
+would not show a stalled database.
+
+Usage:
+    python benchmarks/bench_slow_query.py --slow-ms 2000 --concurrency 50 --duration 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import Depends
+from pymongo import MongoClient
+
+import database
+from main import app
+
+# Reads waiting_sessions by studentId; nobody has this id, so the result is empty
+FAST_ROUTE = "/user/waiting_sessions"
+FAST_HEADERS = {"studentId": "bench-slow-query"}
+SLOW_QUERY = (
+    "function() { var t = Date.now(); while (Date.now() - t < %d) {} return true; }"
+)
+
+
+def add_slow_routes(slow_ms: int):
+    sync_db = MongoClient(database.MONGO_URI)[database.DATABASE_NAME]
+    query = {"$where": SLOW_QUERY % slow_ms}
+
+    @app.get("/_bench/slow/blocking")
+    async def slow_blocking():
+        sync_db["printers"].find_one(query)
+        return {}
+
+    @app.get("/_bench/slow/async")
+    async def slow_async(db=Depends(database.get_database)):
+        await db["printers"].find_one(query)
+        return {}
+
+
+async def run_mode(client: httpx.AsyncClient, mode: str, concurrency: int, duration: float):
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def fast_worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await client.get(FAST_ROUTE, headers=FAST_HEADERS)
+            latencies.append(time.perf_counter() - start)
+
+    async def slow_worker():
+        while time.perf_counter() < deadline:
+            await client.get(f"/_bench/slow/{mode}")
+
+    started = time.perf_counter()
+    await asyncio.gather(slow_worker(), *(fast_worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slow-ms", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    add_slow_routes(args.slow_ms)
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for mode in ("blocking", "async"):
+                print(await run_mode(client, mode, args.concurrency, args.duration))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
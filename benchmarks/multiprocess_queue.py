@@ -0,0 +1,115 @@
+"""
+Exactly-once check for the printer queue with several API processes.
+
+Starts N uvicorn processes against the MongoDB from .env, submits print jobs
+round-robin across them, kills one process part-way through so its printer
+leases expire and get taken over, then verifies that every accepted job was
+printed exactly once.
+
+The database named in DATABASE_NAME is dropped first: point it at a scratch database.
+
+Usage:
+    python benchmarks/multiprocess_queue.py --processes 3 --jobs 60
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+from pymongo import MongoClient
+
+import database
+from main import DEFAULT_PRINTERS
+
+
+def start_process(port: int):
+    env = dict(
+        os.environ,
+        PRINT_SECONDS="0.2",
+        PRINTER_LEASE_TTL_SECONDS="3",
+        PRINTER_LEASE_HEARTBEAT_SECONDS="1",
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+
+
+def wait_until_up(port: int, timeout: float = 20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=60)
+    parser.add_argument("--base-port", type=int, default=8100)
+    args = parser.parse_args()
+
+    db = MongoClient(database.MONGO_URI)[database.DATABASE_NAME]
+    db.client.drop_database(database.DATABASE_NAME)
+    db["students"].insert_one({
+        "name": "Bench", "studentId": "bench", "email": "bench@example.com",
+        "faculty": "CSE", "numberOfA4": 10 ** 9, "numberOfPrintedDocs": 0,
+    })
+
+    ports = [args.base_port + i for i in range(args.processes)]
+    processes = [start_process(port) for port in ports]
+    try:
+        for port in ports:
+            wait_until_up(port)
+
+        def submit(i):
+            port = ports[i % len(ports)]
+            response = httpx.post(
+                f"http://127.0.0.1:{port}/user/print_document",
+                headers={"studentId": "bench"},
+                json={"fileName": f"job-{i}.pdf", "pages": 1, "copies": 1,
+                      "printer": DEFAULT_PRINTERS[i % len(DEFAULT_PRINTERS)]},
+                timeout=30,
+            )
+            return response.status_code == 200
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            accepted = sum(pool.map(submit, range(args.jobs)))
+
+        # Kill the process that most likely owns the leases to force a takeover
+        processes[0].kill()
+
+        deadline = time.time() + 120
+        while time.time() < deadline:
+            if db["waiting_sessions"].count_documents({"status": {"$in": ["WAITING", "PRINTING"]}}) == 0:
+                break
+            time.sleep(0.5)
+
+        printed = Counter(doc["fileId"] for doc in db["printing_history"].find({}, {"fileId": 1}))
+        duplicates = [file_id for file_id, count in printed.items() if count > 1]
+        print({
+            "accepted": accepted,
+            "printed": len(printed),
+            "duplicates": len(duplicates),
+            "pending": db["waiting_sessions"].count_documents({"status": {"$in": ["WAITING", "PRINTING"]}}),
+        })
+        if duplicates or len(printed) != accepted:
+            sys.exit(1)
+    finally:
+        for process in processes:
+            process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Fleet load simulation of the printer scheduler with the page-rate driver.
+
+Replays a simulated day of campus printing through the real PrinterScheduler:
+jobs are stored in waiting_sessions and handed to `submit()`, then claimed,
+printed by SimulatedDriver, completed and written to history by the printer
+workers, as they are behind the API. Time is accelerated by --time-scale.
+
+Students arrive as a Poisson process following an hourly profile with morning
+and afternoon peaks, each submitting on average --files-per-student files back
+to back, scaled so the day totals about --jobs jobs. A student's files go to
+one printer, chosen like `print_document` does: among the printers not
+disabled by an admin, either the least loaded (`printer: "auto"`) or at random,
+as students picking by name do. --coalesce turns on PRINTER_COALESCE. Reports
+queue wait and turnaround percentiles (simulated minutes), jams, print runs,
+jobs per busy printer-hour and per-printer utilization, and fails if a job was
+not completed and recorded in history exactly once.
+
+Runs against the MongoDB from .env, whose DATABASE_NAME is dropped first (point
+it at a scratch database), or with --mongod against a throwaway replica set.
+Every database round trip of the workers is scaled up by --time-scale too, so
+keep it moderate.
+
+Usage:
+    python benchmarks/simulate_fleet.py --mongod mongod --jobs 6000 --time-scale 120 --routing auto
+    python benchmarks/simulate_fleet.py --mongod mongod --jobs 6000 --time-scale 120 --routing auto --coalesce
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+import scheduler
+from bench_endpoints import start_mongod
+from drivers import SimulatedDriver, PrinterJam
+from indexes import ensure_indexes
+from main import initialize_printers
+from printers import printer_cache, printer_area
+from utils import now_utc
+
+# Relative arrival rate for each hour of the day (7:00 to 21:00)
+HOURLY_PROFILE = {7: 2, 8: 5, 9: 8, 10: 9, 11: 7, 12: 4, 13: 6, 14: 8, 15: 8, 16: 6, 17: 4, 18: 3, 19: 2, 20: 1}
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class RecordingDriver(SimulatedDriver):
+    """
+    SimulatedDriver that records, in simulated seconds, when each job starts
+    and finishes printing and how long each printer is busy.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.busy_seconds = {}
+        self.started = set()  # fileIds that started printing at least once
+        self.waits = []
+        self.turnarounds = []
+        self.jams = 0
+        self.runs = 0
+
+    async def print_job(self, printer: str, job: dict):
+        documents = job.get("jobs", [job])
+        started = self.now()
+        for document in documents:
+            if document["fileId"] not in self.started:
+                self.started.add(document["fileId"])
+                self.waits.append(started - document["arrived"])
+        try:
+            await super().print_job(printer, job)
+        except PrinterJam:
+            self.jams += 1
+            raise
+        finally:
+            self.busy_seconds[printer] = self.busy_seconds.get(printer, 0.0) + self.now() - started
+        self.runs += 1
+        self.turnarounds.extend(self.now() - document["arrived"] for document in documents)
+
+
+def route(printer_scheduler, routing: str, rng: random.Random):
+    if routing == "auto":
+        return printer_scheduler.pick_printer(printer_cache.nearest_available())
+    return rng.choice(printer_cache.available())
+
+
+async def submit(db, printer_scheduler, printer: str, student: int, pages: int, copies: int, duplex: bool,
+                 arrived: float, file_number: int):
+    job = {
+        "studentId": str(student),
+        "studentName": f"Student {student}",
+        "faculty": "Simulation",
+        "fileName": f"file-{file_number}.pdf",
+        "fileId": str(file_number),
+        "pages": pages * copies,
+        "printer": printer,
+        "place": printer,
+        "copies": copies,
+        "duplex": duplex,
+        "area": printer_area(printer),
+        "status": "WAITING",
+        "submission_time": now_utc(),
+        "arrived": arrived,  # Simulated clock, for the driver's records
+    }
+    await db["waiting_sessions"].insert_one(job)
+    printer_scheduler.submit(job)
+
+
+async def simulate(args, db) -> dict:
+    rng = random.Random(args.seed)
+    driver = RecordingDriver(
+        pages_per_minute=args.ppm, job_overhead_seconds=args.job_overhead, warmup_seconds=args.warmup,
+        jam_probability=args.jam_probability, duplex=True, time_scale=args.time_scale, seed=args.seed,
+    )
+    scheduler.COALESCE_JOBS = args.coalesce
+    scheduler.COALESCE_MAX_PAGES = args.coalesce_max_pages
+    # Submission times are real, so the window shrinks with the time scale
+    scheduler.COALESCE_WINDOW = timedelta(seconds=args.coalesce_window / args.time_scale)
+    printer_scheduler = scheduler.PrinterScheduler(driver=driver)
+    await printer_scheduler.start()
+
+    total_weight = sum(HOURLY_PROFILE.values())
+    day_started = driver.now()
+    submitted = students = 0
+    arrival = day_started
+    try:
+        for hour, weight in HOURLY_PROFILE.items():
+            # Students per simulated second
+            rate = args.jobs / args.files_per_student * weight / total_weight / 3600
+            hour_end = day_started + (hour - 6) * 3600
+            while True:
+                # Arrivals are scheduled on the simulated clock so sleep overhead does not thin them out
+                arrival += rng.expovariate(rate)
+                if arrival >= hour_end:
+                    arrival = hour_end
+                    break
+                await asyncio.sleep(max(0.0, arrival - driver.now()) / args.time_scale)
+                students += 1
+                printer = route(printer_scheduler, args.routing, rng)
+                duplex = rng.random() < args.duplex_share
+                # Geometric number of files with mean --files-per-student, submitted one after another
+                files = 1
+                while rng.random() < 1 - 1 / args.files_per_student:
+                    files += 1
+                for _ in range(files):
+                    pages = max(1, int(rng.lognormvariate(1.6, 0.9)))
+                    submitted += 1
+                    await submit(db, printer_scheduler, printer, students, pages, rng.choice([1, 1, 1, 2, 3]),
+                                 duplex, driver.now(), submitted)
+
+        while len(driver.turnarounds) < submitted:
+            await asyncio.sleep(0.05)
+        elapsed = driver.now() - day_started
+    finally:
+        await printer_scheduler.stop()
+
+    completed = await db["waiting_sessions"].count_documents({"status": "COMPLETE"})
+    history = await db["printing_history"].count_documents({})
+
+    def minutes(values, p):
+        return round(percentile(values, p) / 60, 2)
+
+    return {
+        "routing": args.routing,
+        "coalesce": args.coalesce,
+        "jobs": submitted,
+        "completed": completed,
+        "history_rows": history,
+        "runs": driver.runs,
+        "jams": driver.jams,
+        "jobs_per_busy_printer_hour": round(submitted / (sum(driver.busy_seconds.values()) / 3600), 1),
+        "simulated_hours": round(elapsed / 3600, 2),
+        "wait_minutes": {"p50": minutes(driver.waits, 50), "p95": minutes(driver.waits, 95),
+                         "p99": minutes(driver.waits, 99), "max": minutes(driver.waits, 100)},
+        "turnaround_minutes": {"p50": minutes(driver.turnarounds, 50), "p95": minutes(driver.turnarounds, 95),
+                               "p99": minutes(driver.turnarounds, 99)},
+        "utilization": {printer: round(busy / elapsed, 3) for printer, busy in sorted(driver.busy_seconds.items())},
+    }
+
+
+async def run(args) -> dict:
+    db = await database.connect_to_database()
+    try:
+        await database.get_client().drop_database(database.DATABASE_NAME)
+        await ensure_indexes(db)
+        await initialize_printers(db)
+        await printer_cache.start()
+        try:
+            return await simulate(args, db)
+        finally:
+            await printer_cache.stop()
+    finally:
+        await database.close_database_connection()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=6000, help="jobs over the simulated day")
+    parser.add_argument("--routing", choices=["auto", "random"], default="auto")
+    parser.add_argument("--time-scale", type=float, default=120, help="simulated seconds per real second")
+    parser.add_argument("--files-per-student", type=float, default=2, help="mean files a student submits at once")
+    parser.add_argument("--ppm", type=float, default=20, help="pages per minute of every printer")
+    parser.add_argument("--job-overhead", type=float, default=5, help="fixed seconds per print run")
+    parser.add_argument("--warmup", type=float, default=10, help="warm-up seconds after idling")
+    parser.add_argument("--jam-probability", type=float, default=0.01)
+    parser.add_argument("--duplex-share", type=float, default=0.5, help="fraction of jobs printed duplex")
+    parser.add_argument("--coalesce", action="store_true", help="merge adjacent jobs of one student")
+    parser.add_argument("--coalesce-max-pages", type=int, default=50)
+    parser.add_argument("--coalesce-window", type=float, default=120, help="seconds between first and last job")
+    parser.add_argument("--mongod", help="mongod binary to start a throwaway replica set with")
+    parser.add_argument("--mongod-port", type=int, default=27901)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    mongod = dbpath = None
+    if args.mongod:
+        mongod, dbpath, database.MONGO_URI = start_mongod(args.mongod, args.mongod_port)
+        database.DATABASE_NAME = database.DATABASE_NAME or "simulation"
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if mongod:
+            mongod.kill()
+            mongod.wait()
+            shutil.rmtree(dbpath, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if not results["completed"] == results["history_rows"] == results["jobs"]:
+        print("Not every job was completed and recorded exactly once")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
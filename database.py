@@ -1,6 +1,11 @@
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
+import gridfs
+import logging
 import os
 from dotenv import load_dotenv
+from metrics import command_timer
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
@@ -8,10 +13,86 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
-def connect_to_database():
+# Connection pool settings (all timeouts in milliseconds)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) or None
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0")) or None
+
+# The single client shared by every router and background worker
+_client = None
+_db = None
+_fs = None
+_supports_transactions = False
+
+
+async def connect_to_database():
+    """
+    Open the shared async client. Called once from the app lifespan.
+    """
+    global _client, _db, _fs, _supports_transactions
+    if _db is not None:
+        return _db
     if not MONGO_URI or not DATABASE_NAME:
         raise ValueError("Missing MongoDB connection details in .env file")
-    client = MongoClient(MONGO_URI)
-    db = client[DATABASE_NAME]
-    print(f"Connected to MongoDB database: {DATABASE_NAME}")
-    return db
+    _client = AsyncMongoClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[command_timer],
+    )
+    _db = _client[DATABASE_NAME]
+    _fs = gridfs.AsyncGridFS(_db)
+    # Multi-document transactions need a replica set or a sharded cluster
+    try:
+        hello = await _db.command("hello")
+        _supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+    except Exception as e:
+        logger.warning("Could not detect MongoDB topology", extra={"error": str(e)})
+        _supports_transactions = False
+    logger.info("Connected to MongoDB", extra={"database": DATABASE_NAME, "transactions": _supports_transactions})
+    return _db
+
+
+async def close_database_connection():
+    global _client, _db, _fs, _supports_transactions
+    if _client is not None:
+        await _client.close()
+    _client = None
+    _db = None
+    _fs = None
+    _supports_transactions = False
+
+
+def get_database():
+    """
+    FastAPI dependency returning the shared database handle.
+    """
+    if _db is None:
+        raise RuntimeError("Database is not connected; connect_to_database() must run in the app lifespan")
+    return _db
+
+
+def get_gridfs():
+    """
+    FastAPI dependency returning the GridFS store on the shared database.
+    """
+    get_database()
+    return _fs
+
+
+def get_client():
+    get_database()
+    return _client
+
+
+def supports_transactions():
+    return _supports_transactions
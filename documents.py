@@ -0,0 +1,262 @@
+"""
+PDF upload handling: chunked streaming into GridFS, content-addressed
+deduplication and PDF analysis off the event loop.
+
+Uploads are spooled to a temporary file in fixed-size chunks (never held whole
+in memory) and hashed with SHA-256 as they stream in. The `documents`
+collection is keyed by that hash and caches the derived metadata (page count,
+page sizes, color/mono), so an identical file reuses the existing GridFS object
+and skips PDF parsing entirely. PdfReader is CPU bound, so new files are
+analysed in a process pool started and shut down with the app lifespan.
+
+`documents.refCount` counts the print jobs referencing a file. It is bumped by
+print_document and released when a job is discarded or archived. A file with no
+references that nobody uploaded within DOCUMENT_GC_GRACE_HOURS is deleted: at
+once when its last reference is released, otherwise by the archiver's periodic
+collect_unreferenced_documents() pass, which also removes uploads never printed.
+`uploads` records which students uploaded which file and under what name.
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ContentStream
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Unreferenced files younger than this are kept: they were uploaded but not printed yet
+DOCUMENT_GC_GRACE = timedelta(hours=float(os.getenv("DOCUMENT_GC_GRACE_HOURS", "24")))
+
+# Content stream operators that set a non-gray fill/stroke color
+RGB_OPERATORS = {b"rg", b"RG"}
+CMYK_OPERATORS = {b"k", b"K"}
+GENERIC_OPERATORS = {b"sc", b"SC", b"scn", b"SCN"}
+
+_pdf_pool = None
+
+
+class InvalidDocument(Exception):
+    pass
+
+
+def start_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        # Workers must not be forks of a process already running the event loop and the Mongo client
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(method)
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=context)
+
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(cancel_futures=True)
+    _pdf_pool = None
+
+
+def _is_color(operator: bytes, operands: list) -> bool:
+    try:
+        values = [float(value) for value in operands if not hasattr(value, "startswith")]
+    except (TypeError, ValueError):
+        return False
+    if operator in RGB_OPERATORS or (operator in GENERIC_OPERATORS and len(values) == 3):
+        return len(values) == 3 and not (values[0] == values[1] == values[2])
+    if operator in CMYK_OPERATORS or (operator in GENERIC_OPERATORS and len(values) == 4):
+        return len(values) == 4 and any(values[:3])
+    return False
+
+
+def _page_has_color(reader, page) -> bool:
+    resources = page.get("/Resources") or {}
+    xobjects = resources.get("/XObject") or {}
+    for name in xobjects:
+        xobject = xobjects[name].get_object()
+        if xobject.get("/Subtype") != "/Image":
+            continue
+        colorspace = xobject.get("/ColorSpace")
+        if colorspace in ("/DeviceRGB", "/DeviceCMYK"):
+            return True
+        if isinstance(colorspace, list) and colorspace and colorspace[0] == "/ICCBased":
+            if colorspace[1].get_object().get("/N", 1) >= 3:
+                return True
+    contents = page.get_contents()
+    if contents is None:
+        return False
+    for operands, operator in ContentStream(contents, reader).operations:
+        if _is_color(operator, operands):
+            return True
+    return False
+
+
+def analyze_pdf(path: str) -> dict:
+    """
+    Runs in a pool worker process. Raises on anything that is not a readable PDF.
+    Color detection is a heuristic over color operators and image color spaces.
+    """
+    with open(path, "rb") as f:
+        if f.read(5) != b"%PDF-":
+            raise ValueError("Not a PDF file")
+    reader = PdfReader(path)
+    if reader.is_encrypted:
+        reader.decrypt("")
+    page_sizes = {}
+    color_pages = 0
+    for page in reader.pages:
+        size = (round(float(page.mediabox.width)), round(float(page.mediabox.height)))
+        page_sizes[size] = page_sizes.get(size, 0) + 1
+        try:
+            color_pages += _page_has_color(reader, page)
+        except Exception:
+            # Unparseable content stream: assume color rather than under-bill
+            color_pages += 1
+    return {
+        "pages": len(reader.pages),
+        "pageSizes": [{"width": w, "height": h, "count": count} for (w, h), count in page_sizes.items()],
+        "colorPages": color_pages,
+        "color": color_pages > 0,
+    }
+
+
+async def inspect_pdf(path: str) -> dict:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_pdf_pool, analyze_pdf, path)
+    except Exception as e:
+        raise InvalidDocument(f"Invalid PDF: {e}")
+
+
+async def spool_upload(upload):
+    """
+    Copy an UploadFile to a temporary file in chunks, hashing it on the way.
+    Returns (path, sha256 hex digest, size).
+    """
+    size = 0
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise InvalidDocument(f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    if size == 0:
+        os.unlink(path)
+        raise InvalidDocument("Empty file")
+    return path, digest.hexdigest(), size
+
+
+async def store_pdf(fs, path: str, filename: str, metadata: dict):
+    """
+    Stream a spooled file into GridFS chunk by chunk and return the new file id.
+    """
+    grid_in = fs.new_file(filename=filename, content_type="application/pdf", metadata=metadata)
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(UPLOAD_CHUNK_SIZE):
+                await grid_in.write(chunk)
+    except BaseException:
+        await grid_in.abort()
+        raise
+    await grid_in.close()
+    return grid_in._id
+
+
+async def _store_new_document(db, fs, path: str, sha256: str, size: int, filename: str) -> dict:
+    info = await inspect_pdf(path)
+    if info["pages"] <= 0:
+        raise InvalidDocument("PDF has no pages")
+    file_id = await store_pdf(fs, path, filename, {"sha256": sha256, "pages": info["pages"]})
+    now = datetime.now(timezone.utc)
+    document = {"_id": sha256, "fileId": file_id, "length": size, **info,
+                "refCount": 0, "createdAt": now, "lastUploadAt": now}
+    try:
+        await db["documents"].insert_one(document)
+    except DuplicateKeyError:
+        # An identical file was stored concurrently: keep that copy
+        await fs.delete(file_id)
+        document = await db["documents"].find_one({"_id": sha256})
+    return document
+
+
+async def save_uploaded_pdf(db, fs, upload, student_id: str) -> dict:
+    """
+    Store an uploaded PDF, reusing the GridFS object and cached metadata of an identical file.
+    """
+    path, sha256, size = await spool_upload(upload)
+    try:
+        document = await db["documents"].find_one_and_update(
+            {"_id": sha256},
+            {"$set": {"lastUploadAt": datetime.now(timezone.utc)}, "$inc": {"uploadCount": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if document is None:
+            document = await _store_new_document(db, fs, path, sha256, size, upload.filename)
+    finally:
+        os.unlink(path)
+
+    await db["uploads"].update_one(
+        {"studentId": student_id, "fileId": document["fileId"]},
+        {"$set": {"fileName": upload.filename, "sha256": sha256, "pages": document["pages"],
+                  "uploadedAt": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    return {
+        "fileId": str(document["fileId"]),
+        "fileName": upload.filename,
+        "pages": document["pages"],
+        "pageSizes": document["pageSizes"],
+        "color": document["color"],
+        "sha256": sha256,
+    }
+
+
+async def reference_document(db, sha256: str, session=None):
+    await db["documents"].update_one({"_id": sha256}, {"$inc": {"refCount": 1}}, session=session)
+
+
+async def release_document(db, fs, sha256: str):
+    """
+    Drop one job reference. A file uploaded again within the grace period is
+    left for collect_unreferenced_documents().
+    """
+    document = await db["documents"].find_one_and_update(
+        {"_id": sha256}, {"$inc": {"refCount": -1}}, return_document=ReturnDocument.AFTER
+    )
+    if document and document["refCount"] <= 0:
+        cutoff = datetime.now(timezone.utc) - DOCUMENT_GC_GRACE
+        await _collect(db, fs, {"_id": sha256, "refCount": {"$lte": 0}, "lastUploadAt": {"$lt": cutoff}})
+
+
+async def collect_unreferenced_documents(db, fs) -> int:
+    """
+    Delete files no job references and that nobody uploaded within the grace
+    period, including uploads never printed. Run by every archiver pass.
+    """
+    cutoff = datetime.now(timezone.utc) - DOCUMENT_GC_GRACE
+    collected = 0
+    async for document in db["documents"].find({"refCount": {"$lte": 0}, "lastUploadAt": {"$lt": cutoff}}, {"_id": 1}):
+        collected += await _collect(db, fs, {"_id": document["_id"], "refCount": {"$lte": 0}, "lastUploadAt": {"$lt": cutoff}})
+    return collected
+
+
+async def _collect(db, fs, query: dict) -> int:
+    # Re-check the condition atomically so a concurrent reference wins
+    document = await db["documents"].find_one_and_delete(query)
+    if not document:
+        return 0
+    await fs.delete(document["fileId"])
+    await db["uploads"].delete_many({"fileId": document["fileId"]})
+    return 1
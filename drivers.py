@@ -0,0 +1,126 @@
+"""
+Printer drivers used by the scheduler to carry out a print job.
+
+A driver's `print_job()` returns once the job has left the printer and raises
+`PrinterJam` when it fails part-way; the scheduler then puts the job back in
+the queue. PRINTER_DRIVER selects the driver:
+
+- `fixed` (default): every job takes PRINT_SECONDS, whatever its size.
+- `simulated`: a page-rate model for load testing, configured with
+  SIM_PAGES_PER_MINUTE, SIM_JOB_OVERHEAD_SECONDS, SIM_WARMUP_SECONDS,
+  SIM_IDLE_SLEEP_SECONDS, SIM_JAM_PROBABILITY, SIM_DUPLEX, SIM_DUPLEX_SPEED and
+  SIM_TIME_SCALE. A time scale of 60 runs a simulated hour in one minute.
+- `package.module:ClassName`: a driver class of your own, built without arguments.
+
+A coalesced run reaches the driver as a single job whose `jobs` lists the
+documents printed in it and whose `pages` is their total.
+"""
+import asyncio
+import importlib
+from abc import ABC, abstractmethod
+import math
+import os
+import random
+import time
+
+PRINT_SECONDS = float(os.getenv("PRINT_SECONDS", "30"))  # Simulated processing time per job
+
+
+class PrinterJam(Exception):
+    pass
+
+
+class PrinterDriver(ABC):
+    @abstractmethod
+    async def print_job(self, printer: str, job: dict):
+        ...
+
+
+class FixedDelayDriver(PrinterDriver):
+    """
+    The original behaviour: a fixed delay per job.
+    """
+    def __init__(self, seconds: float = None):
+        self.seconds = PRINT_SECONDS if seconds is None else seconds
+
+    async def print_job(self, printer: str, job: dict):
+        await asyncio.sleep(self.seconds)
+
+
+class SimulatedDriver(PrinterDriver):
+    """
+    Prints at a page rate plus a fixed overhead per run (spooling, first page
+    out), warms up after sitting idle and jams at random.
+    Every delay is divided by `time_scale`; durations it reports are in simulated seconds.
+    """
+    def __init__(self, pages_per_minute: float = 20, job_overhead_seconds: float = 5, warmup_seconds: float = 10,
+                 idle_sleep_seconds: float = 300, jam_probability: float = 0.0, duplex: bool = True,
+                 duplex_speed: float = 0.8, time_scale: float = 1.0, seed: int = None):
+        self.pages_per_minute = pages_per_minute
+        self.job_overhead_seconds = job_overhead_seconds
+        self.warmup_seconds = warmup_seconds
+        self.idle_sleep_seconds = idle_sleep_seconds
+        self.jam_probability = jam_probability
+        self.duplex = duplex
+        self.duplex_speed = duplex_speed
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+        self.last_finished = {}  # printer name -> simulated time the last job left it
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            pages_per_minute=float(os.getenv("SIM_PAGES_PER_MINUTE", "20")),
+            job_overhead_seconds=float(os.getenv("SIM_JOB_OVERHEAD_SECONDS", "5")),
+            warmup_seconds=float(os.getenv("SIM_WARMUP_SECONDS", "10")),
+            idle_sleep_seconds=float(os.getenv("SIM_IDLE_SLEEP_SECONDS", "300")),
+            jam_probability=float(os.getenv("SIM_JAM_PROBABILITY", "0")),
+            duplex=os.getenv("SIM_DUPLEX", "1") == "1",
+            duplex_speed=float(os.getenv("SIM_DUPLEX_SPEED", "0.8")),
+            time_scale=float(os.getenv("SIM_TIME_SCALE", "1")),
+        )
+
+    def now(self) -> float:
+        """
+        Simulated clock, in seconds.
+        """
+        return time.monotonic() * self.time_scale
+
+    def job_seconds(self, printer: str, job: dict) -> float:
+        """
+        Simulated time to print `job`, including warm-up if the printer has gone to sleep.
+        """
+        pages = job["pages"]
+        seconds = 60 * pages / self.pages_per_minute
+        if self.duplex and job.get("duplex"):
+            # Both sides of ceil(pages / 2) sheets per document, printed somewhat slower than simplex
+            sheets = sum(math.ceil(document["pages"] / 2) for document in job.get("jobs", [job]))
+            seconds = 60 * 2 * sheets / (self.pages_per_minute * self.duplex_speed)
+        seconds += self.job_overhead_seconds
+        last = self.last_finished.get(printer)
+        if last is None or self.now() - last > self.idle_sleep_seconds:
+            seconds += self.warmup_seconds
+        return seconds
+
+    async def print_job(self, printer: str, job: dict):
+        seconds = self.job_seconds(printer, job)
+        try:
+            if self.random.random() < self.jam_probability:
+                # Jams part-way through; the pages already printed are wasted
+                await asyncio.sleep(seconds * self.random.random() / self.time_scale)
+                raise PrinterJam(f"Paper jam on {printer}")
+            await asyncio.sleep(seconds / self.time_scale)
+        finally:
+            self.last_finished[printer] = self.now()
+
+
+def create_driver(name: str = None) -> PrinterDriver:
+    name = name or os.getenv("PRINTER_DRIVER", "fixed")
+    if name == "fixed":
+        return FixedDelayDriver()
+    if name == "simulated":
+        return SimulatedDriver.from_env()
+    module, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError(f"Unknown printer driver {name!r}")
+    return getattr(importlib.import_module(module), class_name)()
@@ -0,0 +1,127 @@
+"""
+In-process event bus for print job status changes.
+
+Routers and the scheduler report job changes through `job_changed()`, and the
+bus fans them out to every subscriber whose filter (studentId and/or printer)
+matches. When several API processes run, set JOB_EVENTS_CHANGE_STREAM=1: the
+bus then ignores local reports and is fed by a change stream on
+`waiting_sessions` instead, so every process sees every transition exactly
+once (change streams need a replica set).
+"""
+import asyncio
+import json
+import logging
+import os
+from database import get_database
+from utils import format_time
+
+logger = logging.getLogger(__name__)
+
+USE_CHANGE_STREAM = os.getenv("JOB_EVENTS_CHANGE_STREAM", "0") == "1"
+SUBSCRIBER_QUEUE_SIZE = 100
+
+JOB_EVENT_FIELDS = ("fileId", "fileName", "studentId", "printer", "pages", "copies", "status",
+                    "submission_time", "expected_time", "completion_time")
+
+
+def job_event(job: dict) -> dict:
+    event = {field: job.get(field) for field in JOB_EVENT_FIELDS}
+    event["submission_time"] = format_time(event["submission_time"])
+    event["expected_time"] = format_time(event["expected_time"])
+    event["completion_time"] = format_time(event["completion_time"])
+    event["type"] = "job"
+    return event
+
+
+class Subscription:
+    def __init__(self, student_id=None, printer=None):
+        self.student_id = student_id
+        self.printer = printer
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def matches(self, event: dict) -> bool:
+        if self.student_id is not None and event.get("studentId") != self.student_id:
+            return False
+        if self.printer is not None and event.get("printer") != self.printer:
+            return False
+        return True
+
+
+class EventBus:
+    def __init__(self):
+        self.subscriptions = set()
+        self.listeners = []  # Callables run synchronously for every event, e.g. admission control
+        self.watcher = None
+
+    async def start(self):
+        if USE_CHANGE_STREAM:
+            self.watcher = asyncio.create_task(self._watch_waiting_sessions())
+
+    async def stop(self):
+        if self.watcher:
+            self.watcher.cancel()
+            await asyncio.gather(self.watcher, return_exceptions=True)
+            self.watcher = None
+
+    def subscribe(self, student_id=None, printer=None) -> Subscription:
+        subscription = Subscription(student_id, printer)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def publish(self, event: dict):
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Job event listener failed")
+        for subscription in self.subscriptions:
+            if subscription.matches(event):
+                try:
+                    subscription.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # Slow consumer: drop the event rather than stall the publisher
+                    pass
+
+    def job_changed(self, job: dict, **changes):
+        """
+        Report a job state change made by this process.
+        """
+        if USE_CHANGE_STREAM:
+            return
+        self.publish(job_event({**job, **changes}))
+
+    async def _watch_waiting_sessions(self):
+        db = get_database()
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+        resume_token = None
+        while True:
+            try:
+                async with await db["waiting_sessions"].watch(
+                    pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        if change.get("fullDocument"):
+                            self.publish(job_event(change["fullDocument"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Job event change stream failed, retrying", extra={"error": str(e)})
+                await asyncio.sleep(1)
+
+
+def format_sse(event: dict, name: str = None) -> str:
+    lines = []
+    if name:
+        lines.append(f"event: {name}")
+    lines.append(f"data: {json.dumps(event, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+event_bus = EventBus()
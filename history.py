@@ -0,0 +1,164 @@
+"""
+Printing history records of completed jobs.
+
+Each completed job adds a row to `printing_history` (the student's view), a
+row to `admin_printing_history` and its share of the statistics rollups.
+write_history() writes any number of completions with one bulk_write per
+collection, inside the caller's transaction when a session is given. Both rows
+take the job's _id and are upserted with $setOnInsert, and only jobs whose
+admin row is new are added to the rollups, so writing a completion again is a
+no-op.
+
+Under heavy completion rates the scheduler can write history behind instead
+(COMPLETION_BATCH_SIZE > 0): HistoryBuffer collects completions and flushes
+them when COMPLETION_BATCH_SIZE are pending or every COMPLETION_FLUSH_SECONDS,
+and once more on shutdown. History then trails job completion by up to the
+flush interval, and rows still buffered when a process dies are lost. A
+failed flush is retried on the next one. Flushes run in a transaction when
+the deployment supports it; otherwise a flush failing after the admin rows
+were stored leaves their jobs out of the rollups until `analytics.py
+--rebuild`.
+"""
+import asyncio
+import logging
+import os
+from pymongo import UpdateOne
+from analytics import record_completed_jobs
+from database import get_client, supports_transactions
+
+COMPLETION_BATCH_SIZE = int(os.getenv("COMPLETION_BATCH_SIZE", "0"))  # 0 writes history with each completion
+COMPLETION_FLUSH_SECONDS = float(os.getenv("COMPLETION_FLUSH_SECONDS", "1"))
+
+logger = logging.getLogger(__name__)
+
+
+def student_history_row(job: dict, completed_at) -> dict:
+    return {
+        "_id": job["_id"],
+        "studentId": job["studentId"],
+        "time": completed_at,
+        "fileName": job["fileName"],
+        "pages": job["pages"],
+        "place": job["place"],
+        "printer": job["printer"],
+        "copies": job["copies"],
+        "fileId": job["fileId"],
+    }
+
+
+def admin_history_row(job: dict, completed_at) -> dict:
+    return {
+        "_id": job["_id"],
+        "studentName": job["studentName"],
+        "studentId": job["studentId"],
+        "time": completed_at,
+        "fileName": job["fileName"],
+        "pages": job["pages"],
+        "place": job["place"],
+        "printer": job["printer"],
+        "area": job["area"],
+        "faculty": job.get("faculty"),
+        "copies": job["copies"],
+    }
+
+
+async def write_history(db, completions: list, session=None):
+    """
+    Record (job, completed_at) pairs in both history collections and the rollups.
+    """
+    if not completions:
+        return
+    await _insert_new(db["printing_history"],
+                      [student_history_row(job, completed_at) for job, completed_at in completions], session)
+    # Jobs with an admin row were already counted in the rollups
+    new = await _insert_new(db["admin_printing_history"],
+                            [admin_history_row(job, completed_at) for job, completed_at in completions], session)
+    await record_completed_jobs(db, [(job, completed_at) for job, completed_at in completions
+                                     if job["_id"] in new], session=session)
+
+
+async def _insert_new(collection, rows: list, session) -> set:
+    """
+    Insert the rows whose _id is not stored yet, in one round trip; returns the _ids inserted.
+    """
+    result = await collection.bulk_write(
+        # The upsert takes _id from the filter
+        [UpdateOne({"_id": row.pop("_id")}, {"$setOnInsert": row}, upsert=True) for row in rows],
+        ordered=False, session=session
+    )
+    return set(result.upserted_ids.values())
+
+
+class HistoryBuffer:
+    """
+    Write-behind buffer of completions, flushed in batches.
+    """
+    def __init__(self, batch_size: int = COMPLETION_BATCH_SIZE, flush_seconds: float = COMPLETION_FLUSH_SECONDS):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.pending = []
+        self.full = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.db = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.batch_size > 0
+
+    async def start(self, db):
+        self.db = db
+        if self.enabled:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.pending:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Final history flush failed", extra={"lost": len(self.pending)})
+
+    def add(self, job: dict, completed_at):
+        self.pending.append((job, completed_at))
+        if len(self.pending) >= self.batch_size:
+            self.full.set()
+
+    async def flush(self):
+        async with self.lock:
+            batch, self.pending = self.pending, []
+            self.full.clear()
+
+            async def write(session=None):
+                await write_history(self.db, batch, session=session)
+
+            try:
+                if supports_transactions():
+                    async with get_client().start_session() as session:
+                        await session.with_transaction(write)
+                else:
+                    await write()
+            except BaseException:
+                # Keep the rows for the next flush
+                self.pending[:0] = batch
+                raise
+            logger.debug("Flushed history", extra={"jobs": len(batch)})
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.full.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            if not self.pending:
+                continue
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("History flush failed", extra={"pending": len(self.pending)})
+                await asyncio.sleep(self.flush_seconds)
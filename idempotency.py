@@ -0,0 +1,150 @@
+"""
+Idempotency-Key support for endpoints with side effects.
+
+A client that retries a POST sends the same `Idempotency-Key` header each time.
+The first request with a key records it in `idempotency_keys` as IN_PROGRESS,
+runs the endpoint and stores its response; any request repeating the key
+(per endpoint and studentId) gets the stored response back, marked with
+`Idempotent-Replayed: true`, without running the endpoint again. A duplicate
+arriving while the first is still running waits for it: in the same process
+on an event, across processes by polling the record, for up to
+IDEMPOTENCY_WAIT_SECONDS before answering 409.
+
+Successful responses and deterministic client errors are stored. Server
+errors, 409 and 429 are not, so those retries run again. Reusing a key with a
+different body is rejected with 422. Records expire after
+IDEMPOTENCY_TTL_HOURS through a TTL index. A record left IN_PROGRESS by a
+crashed process can be taken over once IDEMPOTENCY_LOCK_SECONDS have passed.
+"""
+import asyncio
+import functools
+import hashlib
+import os
+import time
+from datetime import timedelta
+import orjson
+from fastapi import HTTPException, Response
+from pymongo.errors import DuplicateKeyError
+from responses import dumps
+from utils import now_utc
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_TTL = timedelta(hours=float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+IDEMPOTENCY_POLL_SECONDS = 0.05
+MAX_KEY_LENGTH = 255
+# Client errors that depend on timing rather than on the request, so a retry should run again
+RETRYABLE_STATUSES = {408, 409, 429}
+
+_running = {}  # record _id -> asyncio.Event set when this process finishes the request
+
+
+def _fingerprint(payload) -> str:
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+async def _acquire(db, record_id: str, fingerprint: str) -> bool:
+    """
+    Claim the key for this request: a new record, or one abandoned by a crashed process.
+    """
+    now = now_utc()
+    lock = {"status": "IN_PROGRESS", "lockedUntil": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            "expiresAt": now + IDEMPOTENCY_TTL}
+    try:
+        await db["idempotency_keys"].insert_one({"_id": record_id, "fingerprint": fingerprint, "createdAt": now,
+                                                 **lock})
+        return True
+    except DuplicateKeyError:
+        pass
+    taken = await db["idempotency_keys"].find_one_and_update(
+        {"_id": record_id, "fingerprint": fingerprint, "status": "IN_PROGRESS", "lockedUntil": {"$lt": now}},
+        {"$set": lock},
+    )
+    return taken is not None
+
+
+async def _store(db, record_id: str, status_code: int, body: bytes):
+    await db["idempotency_keys"].update_one(
+        {"_id": record_id},
+        {"$set": {"status": "DONE", "statusCode": status_code, "body": body, "expiresAt": now_utc() + IDEMPOTENCY_TTL},
+         "$unset": {"lockedUntil": ""}},
+    )
+
+
+def _replay(record: dict) -> Response:
+    return Response(content=record["body"], status_code=record["statusCode"], media_type="application/json",
+                    headers={REPLAYED_HEADER: "true"})
+
+
+async def _wait_for(record_id: str, deadline: float):
+    running = _running.get(record_id)
+    if running is None:
+        # Being handled by another process
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+        return
+    try:
+        await asyncio.wait_for(running.wait(), timeout=max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        pass
+
+
+async def run_once(request, db, payload, handler):
+    """
+    Run `handler()` once per Idempotency-Key; requests without the header always run it.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return await handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} is longer than {MAX_KEY_LENGTH} characters.")
+    record_id = f"{request.url.path}:{request.headers.get('studentId', '')}:{key}"
+    fingerprint = _fingerprint(payload)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+
+    while not await _acquire(db, record_id, fingerprint):
+        record = await db["idempotency_keys"].find_one({"_id": record_id})
+        if record is None:
+            # Released by a failed attempt in the meantime; try to claim it again
+            continue
+        if record["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} was already used for a different request.")
+        if record["status"] == "DONE":
+            return _replay(record)
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail=f"A request with this {IDEMPOTENCY_HEADER} is still in progress.")
+        await _wait_for(record_id, deadline)
+
+    running = _running[record_id] = asyncio.Event()
+    try:
+        try:
+            result = await handler()
+        except HTTPException as e:
+            if e.status_code < 500 and e.status_code not in RETRYABLE_STATUSES:
+                await _store(db, record_id, e.status_code, dumps({"detail": e.detail}))
+            else:
+                await db["idempotency_keys"].delete_one({"_id": record_id})
+            raise
+        except BaseException:
+            await db["idempotency_keys"].delete_one({"_id": record_id})
+            raise
+        await _store(db, record_id, 200, dumps(result))
+        return result
+    finally:
+        running.set()
+        _running.pop(record_id, None)
+
+
+def idempotent(payload: str):
+    """
+    Route decorator applying run_once to an endpoint. The endpoint must take
+    `request` and `db`; `payload` names the body parameter fingerprinted to
+    detect a key reused for a different request.
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(**kwargs):
+            return await run_once(kwargs["request"], kwargs["db"], kwargs[payload], lambda: endpoint(**kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,151 @@
+"""
+Index manifest for the hot collections and an explain() based query report.
+
+The manifest is applied idempotently at startup (create_indexes is a no-op for
+indexes that already exist with the same spec). Run this module directly to
+apply the manifest and print which router queries still fall back to COLLSCAN:
+
+    python indexes.py
+"""
+import asyncio
+import logging
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from archiver import ARCHIVE_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "students": [
+        IndexModel([("studentId", ASCENDING)], name="studentId_unique", unique=True),
+    ],
+    "printers": [
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+    ],
+    "waiting_sessions": [
+        # Printer queue: next WAITING job for a printer in submission order
+        IndexModel([("printer", ASCENDING), ("status", ASCENDING), ("_id", ASCENDING)], name="printer_status_id"),
+        IndexModel([("studentId", ASCENDING)], name="studentId"),
+        IndexModel([("fileId", ASCENDING)], name="fileId_unique", unique=True),
+        # Archiver: finished jobs past the grace period
+        IndexModel([("status", ASCENDING), ("completion_time", ASCENDING)], name="status_completion_time"),
+    ],
+    "waiting_sessions_archive": [
+        IndexModel([("archivedAt", ASCENDING)], name="archivedAt_ttl",
+                   expireAfterSeconds=ARCHIVE_RETENTION_DAYS * 24 * 3600),
+        IndexModel([("studentId", ASCENDING)], name="studentId"),
+    ],
+    "printer_leases": [
+        # Expired leases are free anyway; let MongoDB remove the ones nobody renews
+        IndexModel([("expiresAt", ASCENDING)], name="expiresAt_ttl", expireAfterSeconds=0),
+    ],
+    "idempotency_keys": [
+        IndexModel([("expiresAt", ASCENDING)], name="expiresAt_ttl", expireAfterSeconds=0),
+    ],
+    "printing_history": [
+        IndexModel([("studentId", ASCENDING), ("_id", DESCENDING)], name="studentId_id"),
+    ],
+    "transactions": [
+        IndexModel([("studentId", ASCENDING), ("_id", DESCENDING)], name="studentId_id"),
+    ],
+    "uploads": [
+        IndexModel([("studentId", ASCENDING), ("fileId", ASCENDING)], name="studentId_fileId_unique", unique=True),
+        IndexModel([("fileId", ASCENDING)], name="fileId"),
+    ],
+    "documents": [
+        # Garbage collection of unreferenced files
+        IndexModel([("refCount", ASCENDING), ("lastUploadAt", ASCENDING)], name="refCount_lastUploadAt"),
+    ],
+    "printing_rollups": [
+        IndexModel([("granularity", ASCENDING), ("bucket", ASCENDING), ("printer", ASCENDING), ("faculty", ASCENDING)],
+                   name="granularity_bucket_printer_faculty_unique", unique=True),
+    ],
+    "admin_printing_history": [
+        # Equality filters, then the (time, _id) keyset used for ranges and pagination
+        IndexModel([("time", DESCENDING), ("_id", DESCENDING)], name="time_id"),
+        IndexModel([("area", ASCENDING), ("time", DESCENDING), ("_id", DESCENDING)], name="area_time_id"),
+        IndexModel([("printer", ASCENDING), ("time", DESCENDING), ("_id", DESCENDING)], name="printer_time_id"),
+        IndexModel([("studentId", ASCENDING), ("time", DESCENDING), ("_id", DESCENDING)], name="studentId_time_id"),
+    ],
+}
+
+# Representative shapes of the queries issued by the routers and the queue worker:
+# (label, collection, filter, sort)
+QUERY_SHAPES = [
+    ("user.personal_information", "students", {"studentId": "0"}, None),
+    ("user.print_document printer", "printers", {"name": "B1-01"}, None),
+    ("user.printing_history", "printing_history", {"studentId": "0"}, [("_id", 1)]),
+    ("user.transaction_history", "transactions", {"studentId": "0"}, [("_id", 1)]),
+    ("user.waiting_sessions", "waiting_sessions", {"studentId": "0"}, None),
+    ("user.confirm_printing", "waiting_sessions", {"fileId": "0"}, None),
+    ("user.printer_queue", "waiting_sessions", {"printer": "B1-01", "status": "WAITING"}, [("_id", 1)]),
+    ("user.completed_jobs", "waiting_sessions", {"printer": "B1-01", "status": "COMPLETE"}, [("_id", 1)]),
+    ("admin.printing_history area", "admin_printing_history", {"area": "B1"}, [("time", 1), ("_id", 1)]),
+    ("admin.printing_history printer", "admin_printing_history", {"printer": "B1-01"}, [("time", 1), ("_id", 1)]),
+    ("admin.printing_history studentId", "admin_printing_history", {"studentId": "0"}, [("time", 1), ("_id", 1)]),
+    ("admin.printing_history time", "admin_printing_history", {"time": {"$gte": datetime(2024, 1, 1)}},
+     [("time", 1), ("_id", 1)]),
+]
+
+
+async def ensure_indexes(db):
+    """
+    Create every index in the manifest. A collection whose index cannot be built
+    (e.g. duplicates blocking a unique index) is reported and skipped.
+    """
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            logger.error("Failed to create indexes", extra={"collection": collection, "error": str(e)})
+    logger.info("Indexes ensured")
+
+
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return [stage for stage in stages if stage]
+
+
+async def explain_queries(db):
+    """
+    Run explain() on each known router query and report its winning plan stages.
+    """
+    report = []
+    for label, collection, query, sort in QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        report.append({
+            "query": label,
+            "collection": collection,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+
+async def main():
+    from database import connect_to_database, close_database_connection
+    from logs import configure_logging
+
+    configure_logging()
+    db = await connect_to_database()
+    try:
+        await ensure_indexes(db)
+        for entry in await explain_queries(db):
+            flag = "COLLSCAN" if entry["collscan"] else "ok"
+            print(f"{flag:8} {entry['query']:35} {' <- '.join(entry['stages'])}")
+    finally:
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,65 @@
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import user, admin
-from database import connect_to_database
+from database import connect_to_database, close_database_connection
+from indexes import ensure_indexes
+from scheduler import printer_scheduler
+from events import event_bus
+from printers import printer_cache
+from archiver import archiver
+from pagination import NEXT_CURSOR_HEADER
+from idempotency import REPLAYED_HEADER
+from documents import start_pdf_pool, shutdown_pdf_pool
+from logs import configure_logging
+from metrics import MetricsMiddleware, metrics_response
 
-app = FastAPI(title="Smart Printing Service API")
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Define default printers
+DEFAULT_PRINTERS = [
+    "B1-01", "B1-02", "B1-03", "B1-04", "B1-05",
+    "A4-01", "A4-02", "A4-03", "B4-01", "B4-02",
+    "C4-01", "C4-02", "C6-01", "B10-01"
+]
+
+
+async def initialize_printers(db):
+    # Ensure the printers collection is initialized
+    for printer in DEFAULT_PRINTERS:
+        await db["printers"].update_one(
+            {"name": printer},                                         # Match by printer name
+            {"$set": {"name": printer, "status": "AVAILABLE", "busy": False, "Note": None}},  # Set or update printer status
+            upsert=True                                                # Insert if not found
+        )
+    logger.info("Printers initialized with AVAILABLE status", extra={"printers": len(DEFAULT_PRINTERS)})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect to MongoDB once; every router shares this client through get_database
+    db = await connect_to_database()
+    await ensure_indexes(db)
+    await initialize_printers(db)
+    await printer_cache.start()
+    start_pdf_pool()
+    await event_bus.start()
+    await printer_scheduler.start()
+    await archiver.start()
+    try:
+        yield
+    finally:
+        await archiver.stop()
+        await printer_scheduler.stop()
+        await event_bus.stop()
+        await printer_cache.stop()
+        shutdown_pdf_pool()
+        await close_database_connection()
 
-# Connect to MongoDB
-db = connect_to_database()
+
+app = FastAPI(title="Smart Printing Service API", lifespan=lifespan)
 
 # CORS setup
 app.add_middleware(
@@ -15,42 +68,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "Link", "Retry-After", REPLAYED_HEADER],
 )
 
 # Include routers
 app.include_router(user.router, prefix="/user", tags=["User APIs"])
 app.include_router(admin.router, prefix="/admin", tags=["Admin APIs"])
 
+# Outermost, so the latency covers the whole middleware stack
+app.add_middleware(MetricsMiddleware, api=app)
+
+
+@app.get("/metrics")
+async def metrics():
+    return metrics_response()
+
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Smart Printing Service API!"}
-
-@app.on_event("startup")
-async def initialize_printers():
-    # Define default printers
-    default_printers = [
-    {"name": "B1-01", "status": "AVAILABLE"},
-    {"name": "B1-02", "status": "AVAILABLE"},
-    {"name": "B1-03", "status": "AVAILABLE"},
-    {"name": "B1-04", "status": "AVAILABLE"},
-    {"name": "B1-05", "status": "AVAILABLE"},
-    {"name": "A4-01", "status": "AVAILABLE"},
-    {"name": "A4-02", "status": "AVAILABLE"},
-    {"name": "A4-03", "status": "AVAILABLE"},
-    {"name": "B4-01", "status": "AVAILABLE"},
-    {"name": "B4-02", "status": "AVAILABLE"},
-    {"name": "C4-01", "status": "AVAILABLE"},
-    {"name": "C4-02", "status": "AVAILABLE"},
-    {"name": "C6-01", "status": "AVAILABLE"},
-    {"name": "B10-01", "status": "AVAILABLE"}
-]
-    
-    # Ensure the printers collection is initialized
-    for printer in default_printers:
-        db["printers"].update_one(
-            {"name": printer["name"]},  # Match by printer name
-            {"$set": printer},          # Set or update printer status
-            upsert=True                 # Insert if not found
-        )
-    print("Printers initialized with AVAILABLE status")
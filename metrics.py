@@ -0,0 +1,132 @@
+"""
+Prometheus metrics served on /metrics.
+
+- HTTP: latency histogram per route template, method and status, and an
+  in-flight gauge per route, recorded by MetricsMiddleware.
+- MongoDB: duration of every command per command name and collection,
+  recorded by a pymongo command listener on the shared client.
+- Scheduler: queue depth, time from submission to printing, print duration
+  and finished jobs by outcome, per printer.
+- Admission control: rejected submissions by reason.
+
+With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory so /metrics aggregates the samples of every worker.
+"""
+import os
+import time
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from pymongo import monitoring
+from starlette.responses import Response
+from starlette.routing import compile_path
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being handled", ["method", "route"], multiprocess_mode="livesum",
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ["command", "collection"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that failed", ["command", "collection"],
+)
+PRINTER_QUEUE_DEPTH = Gauge(
+    "printer_queue_depth", "Jobs queued on a printer leased by this process", ["printer"],
+    multiprocess_mode="livesum",
+)
+PRINT_JOB_WAIT = Histogram(
+    "print_job_wait_seconds", "Time from submission until the job starts printing", ["printer"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200),
+)
+PRINT_JOB_DURATION = Histogram(
+    "print_job_duration_seconds", "Time spent printing a job", ["printer"],
+    buckets=(1, 5, 10, 20, 30, 60, 120, 300, 600),
+)
+PRINT_JOBS = Counter(
+    "print_jobs_total", "Print jobs leaving the queue, by outcome", ["printer", "outcome"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "print_admission_rejections_total", "Print submissions rejected by admission control", ["reason"],
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request. Requests are labelled with the
+    route template (e.g. /user/get_pdf/{file_id}) so labels stay bounded.
+    """
+    def __init__(self, app, api):
+        self.app = app
+        self.api = api
+        self.templates = None
+
+    def _route(self, path: str) -> str:
+        if self.templates is None:
+            # Full paths, router prefixes included, of every documented route
+            self.templates = [(compile_path(template)[0], template) for template in self.api.openapi()["paths"]]
+        for regex, template in self.templates:
+            if regex.match(path):
+                return template
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method, route = scope["method"], self._route(scope["path"])
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_progress.dec()
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(time.perf_counter() - started)
+
+
+def _collection(event) -> str:
+    # Most commands name their collection as the command's value; getMore names it separately
+    value = event.command.get("collection") if event.command_name == "getMore" else event.command.get(event.command_name)
+    return value if isinstance(value, str) else ""
+
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    pymongo command listener recording the duration of each command.
+    """
+    def __init__(self):
+        self.collections = {}  # (connection, request id) -> collection of a command in flight
+
+    def started(self, event):
+        self.collections[(event.connection_id, event.request_id)] = _collection(event)
+
+    def succeeded(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_LATENCY.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_LATENCY.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(event.command_name, collection).inc()
+
+
+command_timer = CommandTimer()
+
+
+def metrics_response() -> Response:
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
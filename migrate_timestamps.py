@@ -0,0 +1,61 @@
+"""
+One-off migration of display-format time strings to BSON datetimes.
+
+Times used to be stored as '%I:%M%p %d/%m/%Y' strings in UTC+7, which cannot
+be range-queried or indexed meaningfully. This rewrites every such string as a
+UTC datetime. It is idempotent: only fields still holding a string are touched.
+
+    python migrate_timestamps.py
+"""
+import asyncio
+from pymongo import UpdateOne
+from utils import parse_display_time
+
+BATCH_SIZE = 1000
+
+TIME_FIELDS = {
+    "printing_history": ["time"],
+    "admin_printing_history": ["time"],
+    "transactions": ["time"],
+    "waiting_sessions": ["submission_time", "expected_time", "completion_time"],
+}
+
+
+async def migrate_field(db, collection: str, field: str) -> int:
+    migrated = 0
+    batch = []
+    cursor = db[collection].find({field: {"$type": "string"}}, {field: 1})
+    async for document in cursor:
+        try:
+            value = parse_display_time(document[field])
+        except ValueError:
+            print(f"Skipping {collection} {document['_id']}: unparseable {field} {document[field]!r}")
+            continue
+        batch.append(UpdateOne({"_id": document["_id"], field: document[field]}, {"$set": {field: value}}))
+        if len(batch) >= BATCH_SIZE:
+            migrated += (await db[collection].bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        migrated += (await db[collection].bulk_write(batch, ordered=False)).modified_count
+    return migrated
+
+
+async def migrate_timestamps(db):
+    for collection, fields in TIME_FIELDS.items():
+        for field in fields:
+            migrated = await migrate_field(db, collection, field)
+            print(f"{collection}.{field}: {migrated} documents migrated")
+
+
+async def main():
+    from database import connect_to_database, close_database_connection
+
+    db = await connect_to_database()
+    try:
+        await migrate_timestamps(db)
+    finally:
+        await close_database_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+Keyset (cursor) pagination for list endpoints.
+
+List routes keep returning a plain JSON list, so existing clients still parse
+the response. A request with neither `limit` nor `cursor` gets every row, as
+before pagination existed. Otherwise each page holds at most `limit` rows
+(DEFAULT_PAGE_SIZE when only a cursor is sent); when more rows exist the
+opaque token for the next page is returned in the `X-Next-Cursor` header (and
+as a `Link: rel="next"` header). Pages are read with a range condition on the
+sort key instead of skip(), so memory and latency stay flat however deep the
+client pages.
+"""
+import base64
+from datetime import datetime
+from typing import Literal, Optional
+from bson import ObjectId, json_util
+from fastapi import HTTPException, Query, Request, Response
+from pymongo import ASCENDING, DESCENDING
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Sort key values a cursor may carry; the last one is always the row's _id
+CURSOR_VALUE_TYPES = (ObjectId, datetime, str, int, float, type(None))
+
+
+class PageParams:
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; omit for the whole list"),
+        cursor: Optional[str] = Query(None, description="Opaque token from the X-Next-Cursor header"),
+        order: Literal["asc", "desc"] = "asc",
+    ):
+        self.limit = limit
+        self.cursor = cursor
+        self.order = order
+
+
+def encode_cursor(key: list, order: str) -> str:
+    raw = json_util.dumps({"k": key, "o": order}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, key_length: int):
+    """
+    Decode a client-supplied token. Its key goes straight into the query, so
+    only plain values are accepted: a document such as {"$exists": true}
+    would be read as a query operator.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json_util.loads(raw)
+        key, order = data["k"], data["o"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if (order not in ("asc", "desc") or not isinstance(key, list) or len(key) != key_length
+            or not isinstance(key[-1], ObjectId) or not all(isinstance(value, CURSOR_VALUE_TYPES) for value in key)):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return key, order
+
+
+def _after(sort_field: str, key: list, order: str) -> dict:
+    op = "$gt" if order == "asc" else "$lt"
+    if sort_field == "_id":
+        return {"_id": {op: key[-1]}}
+    value, last_id = key
+    return {"$or": [{sort_field: {op: value}}, {sort_field: value, "_id": {op: last_id}}]}
+
+
+async def paginate(collection, filters: dict, page: PageParams, request: Request, response: Response,
+                   projection: Optional[dict] = None, sort_field: str = "_id") -> list:
+    """
+    Fetch one page of `collection` matching `filters`, ordered by (`sort_field`, `_id`),
+    and set the next-page headers on `response`. Rows hold exactly the fields of
+    `projection`, when given.
+    """
+    order = page.order
+    # Unpaginated unless the client asks for pages
+    limit = page.limit or (DEFAULT_PAGE_SIZE if page.cursor else None)
+    query = dict(filters)
+    if page.cursor:
+        key, order = decode_cursor(page.cursor, 1 if sort_field == "_id" else 2)
+        query = {"$and": [filters, _after(sort_field, key, order)]}
+
+    direction = ASCENDING if order == "asc" else DESCENDING
+    sort = [("_id", direction)] if sort_field == "_id" else [(sort_field, direction), ("_id", direction)]
+    # The cursor needs the sort key and _id; fetch them even when the projection leaves them out
+    hidden = []
+    if projection is not None:
+        projection = dict(projection)
+        for field in dict.fromkeys((sort_field, "_id")):
+            # _id is returned unless excluded, other fields only when listed
+            excluded = not projection[field] if field in projection else field != "_id"
+            if excluded:
+                projection[field] = 1
+                hidden.append(field)
+
+    cursor = collection.find(query, projection).sort(sort)
+    if limit:
+        # Read one extra row to learn whether another page exists
+        cursor = cursor.limit(limit + 1)
+    rows = await cursor.to_list()
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        key = [last["_id"]] if sort_field == "_id" else [last.get(sort_field), last["_id"]]
+        token = encode_cursor(key, order)
+        response.headers[NEXT_CURSOR_HEADER] = token
+        next_url = request.url.include_query_params(cursor=token, limit=limit)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    if hidden:
+        for row in rows:
+            for field in hidden:
+                row.pop(field, None)
+    return rows
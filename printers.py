@@ -0,0 +1,139 @@
+"""
+In-process cache of printer state.
+
+The fleet is small and changes rarely, so every printer's name, status, busy
+flag and Note are kept in memory and status reads never touch the database.
+`status` is set by admins: an UNAVAILABLE printer is disabled and accepts no
+jobs. `busy` is set by the printer's worker while it prints; jobs queue behind
+a busy printer. Writes go through `set_status()` and `set_busy()`, which update
+MongoDB first and then the cache.
+
+Changes made by other processes are picked up by reloading the whole fleet
+every PRINTER_CACHE_REFRESH_SECONDS, or immediately with
+PRINTER_CACHE_CHANGE_STREAM=1 (change streams need a replica set).
+"""
+import asyncio
+import logging
+import os
+import re
+from database import get_database
+
+logger = logging.getLogger(__name__)
+
+USE_CHANGE_STREAM = os.getenv("PRINTER_CACHE_CHANGE_STREAM", "0") == "1"
+REFRESH_SECONDS = float(os.getenv("PRINTER_CACHE_REFRESH_SECONDS", "5"))
+
+PRINTER_FIELDS = {"_id": 0, "name": 1, "status": 1, "busy": 1, "Note": 1}
+
+
+def printer_area(name: str) -> str:
+    return name.split("-")[0]
+
+
+def area_distance(area: str, other: str):
+    """
+    Sort key for how far `other` is from `area`: same building first, then the closest floor.
+    Areas are a building letter followed by a floor number, e.g. B1 or C6.
+    """
+    a, b = re.match(r"([A-Za-z]*)(\d*)", area), re.match(r"([A-Za-z]*)(\d*)", other)
+    same_building = a.group(1).upper() == b.group(1).upper()
+    floors = abs(int(a.group(2) or 0) - int(b.group(2) or 0))
+    return (not same_building, floors, other)
+
+
+class PrinterCache:
+    def __init__(self):
+        self.printers = {}
+        self.watcher = None
+
+    async def start(self):
+        await self.load(get_database())
+        if USE_CHANGE_STREAM:
+            self.watcher = asyncio.create_task(self._watch_printers())
+        elif REFRESH_SECONDS > 0:
+            self.watcher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self.watcher:
+            self.watcher.cancel()
+            await asyncio.gather(self.watcher, return_exceptions=True)
+            self.watcher = None
+
+    async def load(self, db):
+        """
+        Replace the cache with the current contents of the printers collection.
+        """
+        printers = await db["printers"].find({}, PRINTER_FIELDS).to_list()
+        self.printers = {printer["name"]: printer for printer in printers}
+
+    def get(self, name: str):
+        printer = self.printers.get(name)
+        return dict(printer) if printer else None
+
+    def all(self) -> list:
+        return [dict(printer) for printer in self.printers.values()]
+
+    def available(self) -> list:
+        return [name for name, printer in self.printers.items() if printer["status"] == "AVAILABLE"]
+
+    def nearest_available(self, area: str = None) -> list:
+        """
+        Available printers in `area`, or in the nearest area that has any. All available printers without an area.
+        Busy printers are included: their queue is what the caller weighs them by.
+        """
+        available = self.available()
+        if not area or not available:
+            return available
+        nearest = min((printer_area(name) for name in available), key=lambda other: area_distance(area, other))
+        return [name for name in available if printer_area(name) == nearest]
+
+    def is_available(self, name: str) -> bool:
+        printer = self.printers.get(name)
+        return printer is not None and printer["status"] != "UNAVAILABLE"
+
+    async def set_status(self, db, name: str, status: str):
+        """
+        Write a printer's status through to MongoDB, then to the cache.
+        """
+        await self._update(db, name, {"status": status})
+
+    async def set_busy(self, db, name: str, busy: bool):
+        """
+        Record whether the printer is printing right now. Does not affect whether it accepts jobs.
+        """
+        await self._update(db, name, {"busy": busy})
+
+    async def _update(self, db, name: str, fields: dict):
+        await db["printers"].update_one({"name": name}, {"$set": fields})
+        if name in self.printers:
+            self.printers[name] = {**self.printers[name], **fields}
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(REFRESH_SECONDS)
+            try:
+                await self.load(get_database())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Printer cache refresh failed", extra={"error": str(e)})
+
+    async def _watch_printers(self):
+        db = get_database()
+        resume_token = None
+        while True:
+            try:
+                async with await db["printers"].watch(resume_after=resume_token) as stream:
+                    # Reload after (re)connecting so nothing missed in between is lost
+                    await self.load(db)
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        await self.load(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Printer change stream failed, retrying", extra={"error": str(e)})
+                await asyncio.sleep(1)
+
+
+printer_cache = PrinterCache()
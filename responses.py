@@ -0,0 +1,48 @@
+"""
+Fast JSON responses for documents read straight from MongoDB.
+
+List routes project exactly the fields they return (renaming in the query),
+then hand the rows to MongoJSONResponse, which encodes them with orjson and
+handles BSON types itself: ObjectId as its hex string, datetimes in the UTC+7
+display format and Decimal128 as a decimal string. Returning a response
+object skips FastAPI's per-row response_model validation and
+jsonable_encoder pass; response_model is kept on the routes for the OpenAPI
+schema only.
+"""
+from datetime import datetime
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from utils import format_time
+
+
+def _encode_bson(value):
+    if isinstance(value, datetime):
+        return format_time(value)
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_encode_bson,
+                        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+class MongoJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def lean_response(content, response: Response = None) -> MongoJSONResponse:
+    """
+    Wrap `content` in a MongoJSONResponse, keeping headers (e.g. the next-page
+    cursor) already set on the route's injected `response`.
+    """
+    headers = None
+    if response is not None:
+        headers = {key: value for key, value in response.headers.items() if key != "content-length"}
+    return MongoJSONResponse(content, headers=headers)
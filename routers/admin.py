@@ -1,32 +1,67 @@
 from schemas import Maintenance, AddMaintenanceRequest, AddFileTypeRequest, TogglePrinterRequest, PersonalInfo
-from database import connect_to_database
+from database import get_database
+from indexes import explain_queries
+from pagination import PageParams, paginate
+from responses import lean_response
+from exports import export_stream, EXPORT_FORMATS, EXPORT_CHUNK_ROWS
+from analytics import rollup_stats, period_range, PERIODS
+from printers import printer_cache
+from students import student_cache
+from typing import Literal
 from schemas import PrintingHistory
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from datetime import datetime, timedelta
-import pytz
+from utils import now_utc, timezone_utc_plus_7, format_time, localize_query_time
 import asyncio
 
 router = APIRouter()
-db = connect_to_database()
+
+MAINTENANCE_PROJECTION = {"_id": 0, "title": 1, "description": 1, "startTime": 1, "createdBy": 1,
+                          "duration": 1, "status": 1}
+
+
+def _field_or(*fields, default):
+    """
+    Projection expression: the first of `fields` that is set, else `default`.
+    """
+    expression = default
+    for field in reversed(fields):
+        expression = {"$ifNull": [f"${field}", expression]}
+    return expression
+
+
+# Older history documents lack some of these fields; fill them in the query
+PRINTING_HISTORY_PROJECTION = {
+    "_id": 0,
+    "docName": _field_or("docName", "fileName", default="Unknown"),
+    "printTime": _field_or("printTime", "time", default="Unknown"),
+    "studentName": _field_or("studentName", "studentId", default="Unknown"),
+    "copies": _field_or("copies", "copy", default=1),
+    "printer": 1, "area": 1, "studentId": 1,
+    "place": _field_or("place", "printer", default="Unknown"),
+}
 
 @router.get("/student_information", response_model=PersonalInfo)
-async def get_student_information(studentId: str):
-    student = db["students"].find_one({"studentId": studentId})
+async def get_student_information(studentId: str, db=Depends(get_database)):
+    student = await student_cache.get(db, studentId)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     return student
 
 @router.get("/get_maintenances", response_model=list[Maintenance])
-async def get_maintenances(ended: bool = None):
+async def get_maintenances(request: Request, response: Response, ended: bool = None,
+                           page: PageParams = Depends(), db=Depends(get_database)):
     status_filter = {"status": "ENDED"} if ended else {}
-    maintenances = db["maintenances"].find(status_filter)
-    return list(maintenances)
+    maintenances = await paginate(db["maintenances"], status_filter, page, request, response,
+                                  projection=MAINTENANCE_PROJECTION)
+    return lean_response(maintenances, response)
 
 
 @router.post("/add_maintenance")
-async def add_maintenance(request: AddMaintenanceRequest):
-    db["maintenances"].insert_one({
+async def add_maintenance(request: AddMaintenanceRequest, db=Depends(get_database)):
+    await db["maintenances"].insert_one({
         "title": request.title,
         "description": request.description,
         "startTime": request.startTime,
@@ -37,26 +72,36 @@ async def add_maintenance(request: AddMaintenanceRequest):
 
 
 @router.post("/add_file_type")
-async def add_file_type(request: AddFileTypeRequest):
-    db["file_types"].insert_one({"type": request.fileType})
+async def add_file_type(request: AddFileTypeRequest, db=Depends(get_database)):
+    await db["file_types"].insert_one({"type": request.fileType})
     return {"message": "File type added successfully"}
 
 
 @router.post("/toggle_status")
-async def toggle_printer_status(request: TogglePrinterRequest):
-    printer = db["printers"].find_one({"printerId": request.printerId})
+async def toggle_printer_status(request: TogglePrinterRequest, db=Depends(get_database)):
+    printer = await db["printers"].find_one({"printerId": request.printerId})
     if not printer:
         raise HTTPException(status_code=404, detail="Printer not found")
     new_status = "available" if printer["status"] == "unavailable" else "unavailable"
-    db["printers"].update_one({"printerId": request.printerId}, {
+    await db["printers"].update_one({"printerId": request.printerId}, {
                               "$set": {"status": new_status}})
+    await printer_cache.load(db)
     return {"message": f"Printer {request.printerId} status updated to {new_status}"}
 
 
-@router.get("/printing_history", response_model=list[PrintingHistory])
-async def get_printing_history(area: Optional[str] = None, printer: Optional[str] = None,
-                               studentId: Optional[str] = None, time_filter: Optional[str] = None):
-    # Build the query filter
+# Relative windows accepted by time_filter
+TIME_FILTERS = {
+    "Since 1 day": timedelta(days=1),
+    "Since 1 week": timedelta(weeks=1),
+    "Since 1 month": timedelta(days=30),
+    "Since 3 months": timedelta(days=90),
+    "Since 1 year": timedelta(days=365),
+}
+
+
+def build_history_filters(area: Optional[str] = None, printer: Optional[str] = None,
+                          studentId: Optional[str] = None, time_filter: Optional[str] = None,
+                          time_from: Optional[datetime] = None, time_to: Optional[datetime] = None):
     filters = {}
     if area:
         filters["area"] = area
@@ -64,92 +109,137 @@ async def get_printing_history(area: Optional[str] = None, printer: Optional[str
         filters["printer"] = printer
     if studentId:
         filters["studentId"] = studentId
-    if time_filter:
-        timezone_utc_plus_7 = pytz.timezone('Asia/Bangkok')
-        current_time = datetime.utcnow().replace(
-            tzinfo=pytz.utc).astimezone(timezone_utc_plus_7)
-
-        if time_filter == "Since 1 day":
-            filters["time"] = {
-                "$gte": (current_time - timedelta(days=1)).isoformat()}
-        elif time_filter == "Since 1 week":
-            filters["time"] = {
-                "$gte": (current_time - timedelta(weeks=1)).isoformat()}
-        elif time_filter == "Since 1 month":
-            filters["time"] = {
-                "$gte": (current_time - timedelta(days=30)).isoformat()}
-        elif time_filter == "Since 3 months":
-            filters["time"] = {
-                "$gte": (current_time - timedelta(days=90)).isoformat()}
-        elif time_filter == "Since 1 year":
-            filters["time"] = {
-                "$gte": (current_time - timedelta(days=365)).isoformat()}
-
-    # Fetch the data from the database
-    printing_history = list(db["admin_printing_history"].find(filters))
-    if not printing_history:
-        return []
-
-    # Ensure all required fields are present
-    for record in printing_history:
-        record.setdefault("docName", record.get("fileName", "Unknown"))
-        record.setdefault("printTime", record.get("time", "Unknown"))
-        record.setdefault("studentName", record.get("studentId", "Unknown"))
-        record.setdefault("copies", record.get("copy", 1))
-        record.setdefault("place", record.get("printer", "Unknown"))
-
-    return printing_history
+    # Ranged query on the time index; an explicit from/to overrides time_filter
+    time_range = {}
+    time_from, time_to = localize_query_time(time_from), localize_query_time(time_to)
+    if time_filter in TIME_FILTERS:
+        time_range["$gte"] = now_utc() - TIME_FILTERS[time_filter]
+    if time_from:
+        time_range["$gte"] = time_from
+    if time_to:
+        time_range["$lt"] = time_to
+    if time_range:
+        filters["time"] = time_range
+    return filters
+
+
+@router.get("/printing_history", response_model=list[PrintingHistory])
+async def get_printing_history(request: Request, response: Response,
+                               area: Optional[str] = None, printer: Optional[str] = None,
+                               studentId: Optional[str] = None, time_filter: Optional[str] = None,
+                               time_from: Optional[datetime] = Query(None, alias="from"),
+                               time_to: Optional[datetime] = Query(None, alias="to"),
+                               page: PageParams = Depends(), db=Depends(get_database)):
+    filters = build_history_filters(area, printer, studentId, time_filter, time_from, time_to)
+
+    # Fetch the data from the database, paged by time
+    printing_history = await paginate(db["admin_printing_history"], filters, page, request, response,
+                                      projection=PRINTING_HISTORY_PROJECTION, sort_field="time")
+    return lean_response(printing_history, response)
+
+
+@router.get("/printing_history/export")
+async def export_printing_history(area: Optional[str] = None, printer: Optional[str] = None,
+                                  studentId: Optional[str] = None, time_filter: Optional[str] = None,
+                                  time_from: Optional[datetime] = Query(None, alias="from"),
+                                  time_to: Optional[datetime] = Query(None, alias="to"),
+                                  export_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+                                  gzip: bool = False, db=Depends(get_database)):
+    filters = build_history_filters(area, printer, studentId, time_filter, time_from, time_to)
+    cursor = db["admin_printing_history"].find(filters, PRINTING_HISTORY_PROJECTION).sort("time", 1) \
+        .batch_size(EXPORT_CHUNK_ROWS)
+
+    async def body():
+        try:
+            async for chunk in export_stream(cursor, export_format, list(PrintingHistory.model_fields), gzip):
+                yield chunk
+        finally:
+            await cursor.close()
+
+    media_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"printing_history_{now_utc().astimezone(timezone_utc_plus_7):%Y%m%d_%H%M}.{extension}"
+    if gzip:
+        media_type, filename = "application/gzip", f"{filename}.gz"
+    return StreamingResponse(body(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 
 @router.get("/get_all_printers_status")
 async def get_all_printers_status():
-    # Project only name, status, and Note
-    printers = db["printers"].find(
-        {}, {"_id": 0, "name": 1, "status": 1, "Note": 1})
-    return list(printers)
+    # Name, status, busy flag and Note of every printer, served from the in-process cache
+    return printer_cache.all()
 
 
 @router.post("/toggle_printer_status/{printer_name}")
-async def toggle_printer_status(printer_name: str):
+async def toggle_printer_status(printer_name: str, db=Depends(get_database)):
     """
     Toggle the printer's status between 'AVAILABLE' and 'UNAVAILABLE'.
-    If the printer is already 'UNAVAILABLE', wait for 35 seconds and recheck.
+    The change is written through to the printer cache.
     """
     try:
-        # Find the printer by name
-        printer = db["printers"].find_one({"name": printer_name})
+        printer = printer_cache.get(printer_name)
 
         if not printer:
-            raise HTTPException(status_code=404, detail=f"Printer '{
-                                printer_name}' not found")
+            raise HTTPException(status_code=404, detail=f"Printer '{printer_name}' not found")
 
         # Toggle logic
         if printer["status"] == "AVAILABLE":
-            # Update to UNAVAILABLE immediately
-            db["printers"].update_one(
-                {"name": printer_name},
-                {"$set": {"status": "UNAVAILABLE"}}
-            )
+            await printer_cache.set_status(db, printer_name, "UNAVAILABLE")
             return {"message": f"Printer '{printer_name}' is now UNAVAILABLE"}
-        elif printer["status"] == "UNAVAILABLE":
-
-            # Re-fetch the printer's current status
-            updated_printer = db["printers"].find_one({"name": printer_name})
-
-            if updated_printer["status"] == "AVAILABLE":
-                # Change to UNAVAILABLE if now available
-                db["printers"].update_one(
-                    {"name": printer_name},
-                    {"$set": {"status": "UNAVAILABLE"}}
-                )
-                return {"message": f"Printer '{printer_name}' was AVAILABLE but is now set to UNAVAILABLE"}
-            else:
-                db["printers"].update_one(
-                    {"name": printer_name},
-                    {"$set": {"status": "AVAILABLE"}}
-                )
-                return {"message": f"Printer '{printer_name}' is NOW AVAILABLE"}
+        else:
+            await printer_cache.set_status(db, printer_name, "AVAILABLE")
+            return {"message": f"Printer '{printer_name}' is NOW AVAILABLE"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+@router.get("/cache_stats")
+async def get_cache_stats():
+    """
+    Size and hit/miss counters of the in-process caches, for tuning their size and TTL.
+    """
+    return {"students": student_cache.stats(), "printers": {"size": len(printer_cache.printers)}}
+
+
+@router.get("/index_report")
+async def get_index_report(db=Depends(get_database)):
+    """
+    Explain every known router query and flag the ones still doing a COLLSCAN.
+    """
+    report = await explain_queries(db)
+    return {
+        "collscans": [entry["query"] for entry in report if entry["collscan"]],
+        "queries": report,
+    }
+
+
+@router.get("/stats")
+async def get_printing_stats(group_by: Literal["printer", "area", "faculty", "hour", "day"] = "area",
+                             period: Optional[str] = "this_month",
+                             time_from: Optional[datetime] = Query(None, alias="from"),
+                             time_to: Optional[datetime] = Query(None, alias="to"),
+                             area: Optional[str] = None, printer: Optional[str] = None,
+                             faculty: Optional[str] = None, db=Depends(get_database)):
+    """
+    Pages, copies and job counts per group, answered from the pre-aggregated rollups.
+    An explicit from/to range overrides period (today, this_week, this_month, this_year).
+    """
+    now = now_utc()
+    if time_from or time_to:
+        start = localize_query_time(time_from or datetime(1970, 1, 1))
+        end = localize_query_time(time_to) or now
+    elif period in PERIODS:
+        start, end = period_range(period, now)
+    else:
+        raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(PERIODS)}")
+
+    filters = {key: value for key, value in (("area", area), ("printer", printer), ("faculty", faculty)) if value}
+    rows = await rollup_stats(db, group_by, start, end, filters)
+    if group_by in ("hour", "day"):
+        for row in rows:
+            row["key"] = format_time(row["key"])
+    return {"groupBy": group_by, "from": format_time(start), "to": format_time(end), "rows": rows}
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request, HTTPException, BackgroundTasks, File, UploadFile, Form
+from fastapi import APIRouter, Request, Response, HTTPException, File, UploadFile, Form, Depends
 from schemas import (
     PersonalInfo,
     PrintHistory,
@@ -9,13 +9,23 @@ from schemas import (
     CreateTransactionRequest,
     CancelPrintRequest,
 )
-from PyPDF2 import PdfReader
-from database import connect_to_database
-from utils import get_student_id_from_header
+from database import get_database, get_gridfs, get_client, supports_transactions
+from utils import get_student_id_from_header, now_utc, format_time, etag_matches, parse_byte_range
+from scheduler import printer_scheduler
+from events import event_bus, job_event, format_sse
+from printers import printer_cache, printer_area
+from students import student_cache
+from admission import admission, AdmissionRejected
+from idempotency import idempotent
+from pagination import PageParams, paginate
+from responses import lean_response
+from documents import save_uploaded_pdf, reference_document, release_document, InvalidDocument
+from typing import Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from fastapi.responses import StreamingResponse
 import asyncio
-from datetime import datetime
-import pytz
-import gridfs
+import logging
 from bson import ObjectId
 import random
 import string
@@ -23,22 +33,35 @@ import string
 
 
 router = APIRouter()
-db = connect_to_database()
-fs = gridfs.GridFS(db)
-# Define the UTC+7 timezone
-timezone_utc_plus_7 = pytz.timezone('Asia/Bangkok')
+logger = logging.getLogger(__name__)
+
+# List projections: exactly the fields each route returns, renamed by MongoDB
+PRINT_HISTORY_PROJECTION = {"_id": 0, "time": 1, "fileName": 1, "pages": 1, "printer": 1, "copies": 1, "fileId": 1}
+WAITING_SESSION_PROJECTION = {
+    "_id": 0, "fileId": 1,
+    "time": "$submission_time",
+    "expected_time": {"$ifNull": ["$expected_time", None]},
+    "studentName": 1, "studentId": 1, "fileName": 1, "pages": 1, "printer": 1, "place": 1,
+    "copies": {"$ifNull": ["$copies", 1]},
+    "area": 1, "status": 1, "submission_time": 1,
+    "completion_time": {"$ifNull": ["$completion_time", None]},
+}
+TRANSACTION_PROJECTION = {"_id": 0, "transaction_id": {"$toString": "$_id"}, "time": 1, "title": 1, "payment": 1}
+# Queue listings leave out internal bookkeeping (claims, document hashes)
+JOB_PROJECTION = {"fileId": 1, "fileName": 1, "studentId": 1, "studentName": 1, "pages": 1, "copies": 1,
+                  "printer": 1, "place": 1, "area": 1, "status": 1, "submission_time": 1, "expected_time": 1,
+                  "completion_time": 1}
+
+# Tries at a job insert when its random fileId is already taken
+FILE_ID_ATTEMPTS = 5
 
 def generate_random_digits(length=10):
     return ''.join(random.choices(string.digits, k=length))
 
-# Convert the current time to UTC+7 and format it
-current_time_utc_plus_7 = datetime.utcnow().replace(tzinfo=pytz.utc).astimezone(timezone_utc_plus_7)
-current_time_utc_plus_7 = current_time_utc_plus_7.strftime('%I:%M%p %d/%m/%Y')
-
 @router.post("/add_personal_information")
-async def add_personal_information(personal_info: PersonalInfo):
+async def add_personal_information(personal_info: PersonalInfo, db=Depends(get_database)):
     # Check if student already exists in the database
-    existing_student = db["students"].find_one({"studentId": personal_info.studentId})
+    existing_student = await student_cache.get(db, personal_info.studentId)
     if existing_student:
         raise HTTPException(
             status_code=400, 
@@ -46,15 +69,22 @@ async def add_personal_information(personal_info: PersonalInfo):
         )
     
     # Insert the new student's personal information
-    db["students"].insert_one(personal_info.dict())
+    try:
+        await db["students"].insert_one(personal_info.dict())
+    except DuplicateKeyError:
+        # Registered concurrently since the check above; the unique studentId index rejected this one
+        raise HTTPException(
+            status_code=400,
+            detail=f"Student with ID {personal_info.studentId} already exists"
+        )
     
     return {"message": "Personal information added successfully", "studentId": personal_info.studentId}
 
 
 @router.get("/personal_information", response_model=PersonalInfo)
-async def get_personal_information(request: Request):
+async def get_personal_information(request: Request, db=Depends(get_database)):
     student_id = get_student_id_from_header(request)
-    student = db["students"].find_one({"studentId": student_id})
+    student = await student_cache.get(db, student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     return {
@@ -67,56 +97,31 @@ async def get_personal_information(request: Request):
     }
 
 @router.get("/printing_history", response_model=list[PrintHistory])
-async def get_printing_history(request: Request):
+async def get_printing_history(request: Request, response: Response, page: PageParams = Depends(),
+                               db=Depends(get_database)):
     student_id = get_student_id_from_header(request)
-    history = db["printing_history"].find({"studentId": student_id})
-    return list(history)
+    rows = await paginate(db["printing_history"], {"studentId": student_id}, page, request, response,
+                          projection=PRINT_HISTORY_PROJECTION)
+    return lean_response(rows, response)
 
 @router.get("/waiting_sessions", response_model=list[WaitingSession])
-async def get_waiting_sessions(request: Request):
+async def get_waiting_sessions(request: Request, db=Depends(get_database)):
     student_id = get_student_id_from_header(request)
-    sessions = db["waiting_sessions"].find({"studentId": student_id})
-
-    session_list = []
-    for session in sessions:
-        session_data = {
-            "fileId": session.get("fileId"),  # Convert ObjectId to string
-            "time": session.get("submission_time"),  # Populate if missing
-            "expected_time": session.get("completion_time"),  # Populate if missing
-            "studentName": session["studentName"],
-            "studentId": session["studentId"],
-            "fileName": session["fileName"],
-            "pages": session["pages"],
-            "printer": session["printer"],
-            "place": session["place"],
-            "copies": session.get("copies",1),
-            "area": session["area"],
-            "status": session["status"],
-            "submission_time": session["submission_time"],
-            "completion_time": session.get("completion_time"),  # Handle optional
-        }
-        session_list.append(session_data)
-
-    return session_list
+    sessions = await db["waiting_sessions"].find({"studentId": student_id}, WAITING_SESSION_PROJECTION).to_list()
+    return lean_response(sessions)
 
 
 @router.get("/transaction_history", response_model=list[Transaction])
-async def get_transaction_history(request: Request):
+async def get_transaction_history(request: Request, response: Response, page: PageParams = Depends(),
+                                  db=Depends(get_database)):
     student_id = get_student_id_from_header(request)
-    transactions = db["transactions"].find({"studentId": student_id})
-    
-    # Map the _id field to transaction_id
-    transaction_list = []
-    for transaction in transactions:
-        transaction["transaction_id"] = str(transaction.pop("_id"))
-        transaction_list.append(transaction)
-    
-    return transaction_list
+    transactions = await paginate(db["transactions"], {"studentId": student_id}, page, request, response,
+                                  projection=TRANSACTION_PROJECTION)
+    return lean_response(transactions, response)
 
 @router.get("/get_available_printers")
 async def get_available_printers():
-    printers = list(db["printers"].find({"status": "AVAILABLE"}, {"_id": 0, "name": 1}))
-    return [printer["name"] for printer in printers]
+    return printer_cache.available()
 
 
 
@@ -125,34 +130,41 @@ async def get_available_printers():
 from bson.errors import InvalidId
 
 @router.post("/confirm_printing")
-async def confirm_printing(request: Request, confirm_request: dict):
+async def confirm_printing(request: Request, confirm_request: dict, db=Depends(get_database)):
     try:
-        print(f"Received payload: {confirm_request}")  # Log the received payload
+        logger.debug("confirm_printing payload", extra={"payload": confirm_request})
         session_object_id = confirm_request["fileId"] 
-        print(confirm_request["fileId"])
         # Fetch the session
-        session = db["waiting_sessions"].find_one({"fileId": session_object_id})
+        session = await db["waiting_sessions"].find_one({"fileId": session_object_id})
         if not session:
-            print("Session not found for fileId:", confirm_request.get("fileId"))
+            logger.info("Session not found", extra={"fileId": session_object_id})
             raise HTTPException(status_code=404, detail="Session not found")
 
         if confirm_request.get("dele") == True:
-            if session["status"] == "WAITING":
-                db["waiting_sessions"].update_one(
+            if session["status"] in ("WAITING", "PRINTING"):
+                await db["waiting_sessions"].update_one(
                     {"fileId": session_object_id},
-                    {"$set": {"status": "CANCELLED"}}
+                    {"$set": {"status": "CANCELLED", "cancelled_at": now_utc()}}
                 )
+                # Let the printer worker drop the job without re-reading its status
+                printer_scheduler.cancel(session)
+                event_bus.job_changed(session, status="CANCELLED")
                 return
-            result = db["waiting_sessions"].delete_one({"fileId": session_object_id})
+            result = await db["waiting_sessions"].delete_one({"fileId": session_object_id})
             if result.deleted_count == 0:
                 raise HTTPException(status_code=404, detail="Failed to delete session")
-            return {"message": f"Session with fileId {confirm_request.get("fileId")} successfully deleted."}
+            if session.get("documentHash"):
+                await release_document(db, get_gridfs(), session["documentHash"])
+            event_bus.job_changed(session, status="DELETED")
+            return {"message": f"Session with fileId {confirm_request.get('fileId')} successfully deleted."}
         else:
             # Handle non-deletion logic here if needed
             pass
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in confirm_printing: {e}")
+        logger.exception("Error in confirm_printing", extra={"fileId": confirm_request.get("fileId")})
         raise HTTPException(status_code=500, detail=f"Error in confirm_printing: {str(e)}")
 
 
@@ -160,26 +172,31 @@ async def confirm_printing(request: Request, confirm_request: dict):
 
 
 @router.post("/create_transaction")
-async def create_transaction(request: Request, transaction_data: dict):
+@idempotent(payload="transaction_data")
+async def create_transaction(request: Request, transaction_data: dict, db=Depends(get_database)):
     student_id = get_student_id_from_header(request)
     quantity = transaction_data.get("quantity")
     price = transaction_data.get("price")
-    print(quantity, price)
+    logger.debug("create_transaction", extra={"studentId": student_id, "quantity": quantity, "price": price})
     if not quantity or not price:
         raise HTTPException(status_code=400, detail="Quantity and price are required.")
 
     # Find student in the database
-    student = db["students"].find_one({"studentId": student_id})
+    student = await student_cache.get(db, student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found.")
 
     # Update the student's A4 papers
-    db["students"].update_one({"studentId": student_id}, {"$inc": {"numberOfA4": quantity}})
+    student = await db["students"].find_one_and_update(
+        {"studentId": student_id}, {"$inc": {"numberOfA4": quantity}}, return_document=ReturnDocument.AFTER
+    )
+    if student:
+        student_cache.put(student)
 
     # Log the transaction
-    db["transactions"].insert_one({
+    await db["transactions"].insert_one({
         "studentId": student_id,
-        "time": current_time_utc_plus_7,
+        "time": now_utc(),
         "title": f"Bought {quantity} papers",
         "payment": f"{price} VND",
     })
@@ -192,28 +209,102 @@ async def create_transaction(request: Request, transaction_data: dict):
         
 
 
-PRINTERS = [
-    "B1-01", "B1-02", "B1-03", "B1-04", "B1-05",
-    "A4-01", "A4-02", "A4-03", "B4-01", "B4-02",
-    "C4-01", "C4-02", "C6-01", "B10-01"
-]
+@router.post("/upload_document")
+async def upload_document(request: Request, file: UploadFile = File(...),
+                          db=Depends(get_database), fs=Depends(get_gridfs)):
+    """
+    Upload a PDF into GridFS. The page count is measured server-side and returned
+    with the documentId to pass to /print_document. Identical files are stored once.
+    """
+    student_id = get_student_id_from_header(request)
+    try:
+        document = await save_uploaded_pdf(db, fs, file, student_id)
+    except InvalidDocument as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "documentId": document["fileId"],
+        "fileName": document["fileName"],
+        "pages": document["pages"],
+        "pageSizes": document["pageSizes"],
+        "color": document["color"],
+    }
+
+
+async def deduct_pages_and_queue(db, student_id: str, required_pages: int, copies: int, job: dict):
+    """
+    Deduct the student's A4 balance and queue the job as one unit.
+
+    The balance check and both counters are a single conditional find_one_and_update,
+    so concurrent submissions can never overdraw the balance. On a replica set the job
+    insert runs in the same transaction; on a standalone server a failed insert or
+    document reference is compensated by deleting the job and refunding the deduction.
+    A fileId already taken by another job is replaced and the whole unit retried.
+    The updated profile replaces the cached one once the deduction is committed.
+    """
+    deducted = {}
+
+    async def deduct_and_insert(session=None):
+        student = await db["students"].find_one_and_update(
+            {"studentId": student_id, "numberOfA4": {"$gte": required_pages}},
+            {"$inc": {"numberOfA4": -required_pages, "numberOfPrintedDocs": copies}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if student is None:
+            # Only reached on rejection: tell a missing student from an insufficient balance
+            if not await db["students"].find_one({"studentId": student_id}, {"_id": 1}, session=session):
+                raise HTTPException(status_code=404, detail="Student not found.")
+            raise HTTPException(status_code=400, detail="Not enough A4 pages.")
+        job["studentName"] = student["name"]
+        job["faculty"] = student.get("faculty")
+        try:
+            await db["waiting_sessions"].insert_one(job, session=session)
+            if job.get("documentHash"):
+                await reference_document(db, job["documentHash"], session=session)
+        except Exception:
+            if session is None:
+                # Undo by hand: remove the job if it was stored, so it is not printed unpaid
+                if "_id" in job:
+                    await db["waiting_sessions"].delete_one({"_id": job["_id"]})
+                await db["students"].update_one(
+                    {"studentId": student_id},
+                    {"$inc": {"numberOfA4": required_pages, "numberOfPrintedDocs": -copies}}
+                )
+                student_cache.invalidate(student_id)
+            raise
+        deducted["student"] = student
+
+    for attempt in range(FILE_ID_ATTEMPTS):
+        try:
+            if supports_transactions():
+                async with get_client().start_session() as session:
+                    await session.with_transaction(deduct_and_insert)
+            else:
+                await deduct_and_insert()
+            break
+        except DuplicateKeyError as e:
+            student_cache.invalidate(student_id)
+            if attempt + 1 == FILE_ID_ATTEMPTS or "fileId" not in (e.details or {}).get("keyPattern", {}):
+                raise
+            # Another job drew the same random fileId; the attempt was rolled back, so draw again
+            job.pop("_id", None)
+            job["fileId"] = generate_random_digits()
+        except Exception:
+            student_cache.invalidate(student_id)
+            raise
+    student_cache.put(deducted["student"])
 
-# Initialize all printers as available on startup
-for printer in PRINTERS:
-    db["printers"].update_one(
-        {"name": printer},
-        {"$set": {"status": "AVAILABLE", "Note": None}},
-        upsert=True
-    )
 
-# Track if a printer is actively processing jobs
-active_printers = {}
+# Printer name that lets the server choose the printer
+AUTO_PRINTER = "auto"
+
 
 @router.post("/print_document")
+@idempotent(payload="file_info")
 async def print_document(
     request: Request,
-    background_tasks: BackgroundTasks,
-    file_info: dict
+    file_info: dict,
+    db=Depends(get_database)
 ):
     fileName = file_info.get("fileName")
     pages = file_info.get("pages")
@@ -222,172 +313,222 @@ async def print_document(
     try:
         
         student_id = get_student_id_from_header(request)
-        print(f"Received print request for {fileName} with {pages} pages, {copies} copies on {printer}")
-        # Validate Printer Availability
-        printer_status = db["printers"].find_one({"name": printer})
-        if not printer_status or printer_status["status"] == "UNAVAILABLE":
+        documentId = file_info.get("documentId")
+        if documentId:
+            # Bill the page count measured at upload time rather than the client's figure
+            upload = None
+            if ObjectId.is_valid(documentId):
+                upload = await db["uploads"].find_one({"studentId": student_id, "fileId": ObjectId(documentId)})
+            if not upload:
+                raise HTTPException(status_code=404, detail="Document not found.")
+            fileName = upload["fileName"]
+            pages = upload["pages"]
+        if not isinstance(pages, int) or not isinstance(copies, int) or pages <= 0 or copies <= 0:
+            raise HTTPException(status_code=400, detail="pages and copies must be positive integers.")
+        if printer == AUTO_PRINTER:
+            # Least loaded printer in the requested area, or the nearest area with one available
+            printer = printer_scheduler.pick_printer(printer_cache.nearest_available(file_info.get("area")))
+            if printer is None:
+                raise HTTPException(status_code=400, detail="No printer is currently available.")
+        logger.info("Received print request", extra={"studentId": student_id, "fileName": fileName,
+                                                       "pages": pages, "copies": copies, "printer": printer})
+        # Only printers disabled by an admin refuse jobs; a busy printer queues them
+        if not printer_cache.is_available(printer):
             raise HTTPException(status_code=400, detail="Printer is currently unavailable.")
 
         total_pages = pages * copies
-        
-        # Check Student Balance
-        student = db["students"].find_one({"studentId": student_id})
-        if not student:
-            raise HTTPException(status_code=404, detail="Student not found.")
-        required_pages = total_pages * copies
-        if student["numberOfA4"] < required_pages:
-            raise HTTPException(status_code=400, detail="Not enough A4 pages.")
-
-        # Deduct A4 Pages from Student Account
-        db["students"].update_one({"studentId": student_id}, {"$inc": {"numberOfA4": -required_pages}})
-        db["students"].update_one({"studentId": student_id}, {"$inc": {"numberOfPrintedDocs": copies}})
+        try:
+            admitted = admission.admit(student_id, printer, total_pages)
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
-        # Save PDF to GridFS
-        
         # Save Job to Waiting Queue
-        area = printer.split('-')[0]
-        db["waiting_sessions"].insert_one({
-            "studentName": student["name"],
+        area = printer_area(printer)
+        submitted_at = now_utc()
+        job = {
             "studentId": student_id,
             "fileName": fileName,
             "fileId": generate_random_digits(),  # Convert ObjectId to string
+            "documentId": documentId,
+            "documentHash": upload["sha256"] if documentId else None,
             "pages": total_pages,
             "printer": printer,
             "place": printer,
             "copies": copies,
+            "duplex": bool(file_info.get("duplex", False)),
             "area": area,
             "status": "WAITING",
-            "submission_time": current_time_utc_plus_7
-        })
-
-        # Process the Printing Queue
-        if not active_printers.get(printer, False):
-            background_tasks.add_task(process_printer_queue, printer)
-
-        return {"message": f"Print job for '{fileName}' added successfully with {total_pages} pages, {copies} copies."}
-    except Exception as e:
-        print(f"Error processing print document: {e}")
+            "submission_time": submitted_at,
+            # Estimate from the queue ahead of the job; completion_time is only set once it is printed
+            "expected_time": printer_scheduler.estimate_completion(printer, total_pages, submitted_at),
+        }
+        try:
+            await deduct_pages_and_queue(db, student_id, total_pages, copies, job)
+        except BaseException:
+            admission.abandon(admitted)
+            raise
+
+        # Hand the job to the printer's worker
+        printer_scheduler.submit(job)
+        admission.queued(admitted, job)
+        event_bus.job_changed(job)
+
+        return {
+            "message": f"Print job for '{fileName}' added successfully with {total_pages} pages, {copies} copies.",
+            "printer": printer,
+            "expected_time": format_time(job["expected_time"]),
+        }
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Error processing print document", extra={"printer": printer})
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
-async def process_printer_queue(printer: str):
-    """
-    Background task to process jobs in the printer queue.
-    """
-    global active_printers
-    active_printers[printer] = True
-
-    while True:
-        # Fetch the next job in the queue
-        #set null
-        waiting_job = None
-        waiting_job = db["waiting_sessions"].find_one(
-            {"printer": printer, "status": "WAITING"}, sort=[("_id", 1)]
-        )
-
-        if not waiting_job:
-            # No jobs left in the queue, mark the printer as available
-            active_printers[printer] = False
-            db["printers"].update_one({"name": printer}, {"$set": {"status": "AVAILABLE"}})
-            break
-
-        if waiting_job["status"] == "CANCELLED":
-            # Job is not assigned to this printer, skip it
-            print(f"Skipping cancelled job on {printer}: {waiting_job['fileName']}")
-            db["waiting_sessions"].delete_one({"_id": waiting_job["_id"]})
-            continue
-        # Mark the printer as unavailable
-        db["printers"].update_one({"name": printer}, {"$set": {"status": "UNAVAILABLE"}})
-        # Simulate printing
-        print(f"Processing job on {printer}: {waiting_job['fileName']}")
-        await asyncio.sleep(30)  # Simulate 30-second processing time
-        waiting_job["status"] = db["waiting_sessions"].find_one({"_id": waiting_job["_id"]})["status"]
-        if waiting_job["status"] == "CANCELLED":
-            # Job is not assigned to this printer, skip it
-            print(f"Skipping cancelled job on {printer}: {waiting_job['fileName']}")
-            db["waiting_sessions"].delete_one({"_id": waiting_job["_id"]})
-            continue
-        # Update job status and add to printing history
-        db["waiting_sessions"].update_one(
-            {"_id": waiting_job["_id"]},
-            {"$set": {"status": "COMPLETE", "completion_time": current_time_utc_plus_7}}
-        )
-        db["printing_history"].insert_one({
-            "studentId": waiting_job["studentId"],
-            "time": current_time_utc_plus_7,
-            "fileName": waiting_job["fileName"],
-            "pages": waiting_job["pages"],
-            "place": waiting_job["place"],
-            "printer": waiting_job["printer"],
-            "copies": waiting_job["copies"],
-            "fileId": waiting_job["fileId"]
-        })
-        db["admin_printing_history"].insert_one({
-            "studentName": waiting_job["studentName"],
-            "studentId": waiting_job["studentId"],
-            "time": current_time_utc_plus_7,
-            "fileName": waiting_job["fileName"],
-            "pages": waiting_job["pages"],
-            "place": waiting_job["place"],
-            "printer": waiting_job["printer"],
-            "area": waiting_job["area"],
-            "copies": waiting_job["copies"]
-        })
-
-        print(f"Completed job on {printer}: {waiting_job['fileName']}")
-
-    # Set the printer to available after processing
-    db["printers"].update_one({"name": printer}, {"$set": {"status": "AVAILABLE"}})
-
-
 @router.get("/printer_queue")
-async def get_printer_queue(printer: str):
+async def get_printer_queue(printer: str, db=Depends(get_database)):
     """
     Get the queue of waiting jobs for a specific printer.
     """
-    queue = list(db["waiting_sessions"].find({"printer": printer, "status": "WAITING"}).sort("_id", 1))
-    return {"printer": printer, "queue": queue}
+    queue = await db["waiting_sessions"].find(
+        {"printer": printer, "status": "WAITING"}, JOB_PROJECTION
+    ).sort("_id", 1).to_list()
+    return lean_response({"printer": printer, "queue": queue})
 
 
 @router.get("/completed_jobs")
-async def get_completed_jobs(printer: str):
+async def get_completed_jobs(printer: str, request: Request, response: Response, page: PageParams = Depends(),
+                             db=Depends(get_database)):
     """
     Get the list of completed jobs for a specific printer.
     """
-    completed_jobs = list(db["waiting_sessions"].find({"printer": printer, "status": "COMPLETE"}))
-    return {"printer": printer, "completed_jobs": completed_jobs}
+    completed_jobs = await paginate(db["waiting_sessions"], {"printer": printer, "status": "COMPLETE"},
+                                    page, request, response, projection=JOB_PROJECTION)
+    return lean_response({"printer": printer, "completed_jobs": completed_jobs}, response)
+
+
+
+
+# Seconds between SSE keep-alive comments on an idle job event stream
+JOB_EVENTS_KEEPALIVE_SECONDS = 15
+
+@router.get("/job_events")
+async def stream_job_events(
+    request: Request,
+    studentId: Optional[str] = None,
+    printer: Optional[str] = None,
+    db=Depends(get_database)
+):
+    """
+    Server-Sent Events stream of job status changes for a student and/or a printer.
+    The first event is a snapshot of the current jobs, followed by one event per change.
+    EventSource cannot send headers, so studentId may also be passed as a query parameter.
+    """
+    student_id = request.headers.get("studentId") or studentId
+    if not student_id and not printer:
+        raise HTTPException(status_code=400, detail="studentId or printer is required")
+
+    # Subscribe before taking the snapshot so no change falls in between
+    subscription = event_bus.subscribe(student_id, printer)
+    query = {}
+    if student_id:
+        query["studentId"] = student_id
+    if printer:
+        query["printer"] = printer
+        query["status"] = {"$in": ["WAITING", "PRINTING"]}
+    try:
+        snapshot = await db["waiting_sessions"].find(query).sort("_id", 1).to_list()
+    except Exception:
+        event_bus.unsubscribe(subscription)
+        raise
+
+    async def event_stream():
+        try:
+            yield format_sse({"type": "snapshot", "jobs": [job_event(job) for job in snapshot]}, "snapshot")
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=JOB_EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event, "job")
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 
 
-from io import BytesIO
-from fastapi.responses import StreamingResponse
 from urllib.parse import quote
 
 @router.get("/get_pdf/{file_id}")
-async def get_pdf(file_id: str):
+async def get_pdf(file_id: str, request: Request, fs=Depends(get_gridfs)):
+    """
+    Stream a PDF from GridFS chunk by chunk. Supports single byte ranges
+    (206 Partial Content) so viewers can seek and downloads can resume, and
+    ETag / If-None-Match so repeat views get 304 Not Modified.
+    """
     try:
         # Retrieve the file from GridFS
-        grid_out = fs.get(ObjectId(file_id))
-        
-        # Ensure file content is read correctly
-        file_content = grid_out.read()
-        file_stream = BytesIO(file_content)
-        
-        # Encode the filename for HTTP headers
-        encoded_filename = quote(grid_out.filename)
-        
-        return StreamingResponse(
-            file_stream,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"inline; filename={encoded_filename}"
-            }
-        )
+        grid_out = await fs.get(ObjectId(file_id))
     except Exception as e:
-        print(f"Error retrieving PDF file: {e}")
+        logger.info("PDF not found", extra={"fileId": file_id, "error": str(e)})
         raise HTTPException(status_code=404, detail="File not found")
-    
-
 
+    # GridFS content is immutable, so the md5 (or the upload id for files stored without one) identifies it
+    etag = f'"{grid_out.md5 or f"{grid_out._id}-{grid_out.length}"}"'
+    # Encode the filename for HTTP headers
+    encoded_filename = quote(grid_out.filename or file_id)
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f"inline; filename={encoded_filename}",
+    }
 
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        await grid_out.close()
+        return Response(status_code=304, headers=headers)
+
+    length = grid_out.length
+    start, end = 0, length - 1
+    status_code = 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and length > 0 and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_byte_range(range_header, length)
+        except ValueError:
+            await grid_out.close()
+            raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                                headers={"Content-Range": f"bytes */{length}"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    async def file_stream():
+        try:
+            await grid_out.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await grid_out.read(min(grid_out.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            await grid_out.close()
+
+    return StreamingResponse(
+        file_stream(),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers
+    )
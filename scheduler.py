@@ -0,0 +1,487 @@
+"""
+Long-lived printer job scheduler.
+
+Each printer gets one asyncio worker fed by an in-memory FIFO queue. MongoDB
+(`waiting_sessions`) remains the durable record: submissions are inserted
+before they are enqueued, and queues are rebuilt from the WAITING jobs stored
+there. Cancellations arrive as signals through `cancel()`.
+
+Printing itself is delegated to the driver from `drivers.py` (a fixed delay
+by default, or a page-rate simulator for load tests).
+
+Several API processes can run at once. A printer is only drained by the
+process holding its lease in `printer_leases`; leases are renewed on every
+heartbeat and taken over once they expire. Jobs are claimed atomically
+(WAITING -> PRINTING) and completed only while still claimed by this process,
+so each job is printed exactly once.
+
+Owners also report the pages queued on each printer and its measured
+throughput in the lease, so every process can estimate drain times (and pick
+the least loaded printer) from memory, without querying per submission.
+
+With PRINTER_COALESCE=1, a worker merges the job it takes with the jobs queued
+right behind it from the same student (same duplex setting, submitted within
+PRINTER_COALESCE_WINDOW_SECONDS of the first, PRINTER_COALESCE_MAX_PAGES in
+total) and sends them to the printer as one run, paying the per-job overhead
+once. Each job is still claimed, completed and recorded in history on its own.
+
+Completing a run is one transaction on a replica set: the jobs' status
+updates, their history rows and the statistics rollups commit together.
+With COMPLETION_BATCH_SIZE > 0 the history is written behind in batches by
+a HistoryBuffer instead, flushed when the scheduler stops.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import get_database, get_gridfs, get_client, supports_transactions
+from documents import release_document
+from history import HistoryBuffer, write_history
+from printers import printer_cache
+from drivers import create_driver, PrinterJam
+from events import event_bus
+from metrics import PRINTER_QUEUE_DEPTH, PRINT_JOB_WAIT, PRINT_JOB_DURATION, PRINT_JOBS
+from utils import now_utc
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL_SECONDS = float(os.getenv("PRINTER_LEASE_TTL_SECONDS", "15"))
+HEARTBEAT_SECONDS = float(os.getenv("PRINTER_LEASE_HEARTBEAT_SECONDS", "5"))
+# Throughput assumed for a printer until jobs on it have been timed
+DEFAULT_SECONDS_PER_PAGE = 60 / float(os.getenv("PRINTER_PAGES_PER_MINUTE", "20"))
+THROUGHPUT_SMOOTHING = 0.2  # Weight of the newest job in the moving average
+COALESCE_JOBS = os.getenv("PRINTER_COALESCE", "0") == "1"
+COALESCE_MAX_PAGES = int(os.getenv("PRINTER_COALESCE_MAX_PAGES", "50"))
+COALESCE_WINDOW = timedelta(seconds=float(os.getenv("PRINTER_COALESCE_WINDOW_SECONDS", "120")))
+
+
+def _as_utc(value):
+    # pymongo returns naive datetimes in UTC
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class JobQueue(asyncio.Queue):
+    """
+    FIFO of job documents that lets a worker look at the next job before taking it.
+    """
+    def peek(self):
+        return self._queue[0] if self._queue else None
+
+
+def can_coalesce(run: list, job: dict) -> bool:
+    """
+    Whether `job` may be printed in the same run as the jobs of `run`.
+    """
+    first = run[0]
+    first_submitted, submitted = _as_utc(first.get("submission_time")), _as_utc(job.get("submission_time"))
+    if not isinstance(first_submitted, datetime) or not isinstance(submitted, datetime):
+        return False
+    return (job["studentId"] == first["studentId"]
+            and bool(job.get("duplex")) == bool(first.get("duplex"))
+            and sum(queued["pages"] for queued in run) + job["pages"] <= COALESCE_MAX_PAGES
+            and submitted - first_submitted <= COALESCE_WINDOW)
+
+
+class PrinterScheduler:
+    def __init__(self, driver=None):
+        self.driver = driver   # Created from PRINTER_DRIVER on start when not given
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.queues = {}       # printer name -> JobQueue of job documents
+        self.workers = {}      # printer name -> worker task, only for leased printers
+        self.known_jobs = {}   # printer name -> _ids already enqueued
+        self.cancelled = set() # _ids of jobs cancelled while queued or printing
+        self.queued_pages = {}     # printer name -> pages queued or printing, for leased printers
+        self.seconds_per_page = {} # printer name -> measured seconds per page (moving average)
+        self.remote_load = {}      # printer name -> (queued pages, seconds per page) reported by its owner
+        self.history = HistoryBuffer()
+        self.heartbeat = None
+
+    async def start(self):
+        """
+        Acquire the free printer leases, rebuild their queues and start heartbeating.
+        """
+        if self.driver is None:
+            self.driver = create_driver()
+        await self.history.start(get_database())
+        await self._heartbeat_once()
+        self.heartbeat = asyncio.create_task(self._heartbeat_loop())
+        logger.info("Scheduler started", extra={"instance": self.instance_id, "printers": sorted(self.workers)})
+
+    async def stop(self):
+        tasks = list(self.workers.values())
+        if self.heartbeat:
+            tasks.append(self.heartbeat)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.history.stop()
+        # Hand the leases back so another process can take over immediately
+        await get_database()["printer_leases"].delete_many({"owner": self.instance_id})
+        self.heartbeat = None
+        self.workers.clear()
+        self.queues.clear()
+        self.known_jobs.clear()
+        self.cancelled.clear()
+        self.queued_pages.clear()
+        self.remote_load.clear()
+
+    def owns(self, printer: str) -> bool:
+        return printer in self.workers
+
+    def submit(self, job: dict):
+        """
+        Hand a job that is already stored in waiting_sessions to its printer worker.
+        Jobs for printers leased by another process are picked up by that owner.
+        """
+        if self.owns(job["printer"]):
+            self._enqueue(job)
+        else:
+            # Count it until the owner reports its queue on the next heartbeat
+            pages, seconds_per_page = self.remote_load.get(job["printer"], (0, DEFAULT_SECONDS_PER_PAGE))
+            self.remote_load[job["printer"]] = (pages + job["pages"], seconds_per_page)
+
+    def cancel(self, job: dict):
+        """
+        Signal that a queued (or currently printing) job must not be completed.
+        Only the owner's worker reads (and clears) the mark; other processes rely
+        on the CANCELLED status failing its claim or completion.
+        """
+        if self.owns(job["printer"]):
+            self.cancelled.add(job["_id"])
+
+    def _seconds_per_page(self, printer: str) -> float:
+        if printer in self.seconds_per_page:
+            return self.seconds_per_page[printer]
+        return self.remote_load.get(printer, (0, DEFAULT_SECONDS_PER_PAGE))[1]
+
+    def pending_pages(self, printer: str) -> int:
+        """
+        Pages queued or printing on a printer, from memory (reported by the owner for remote printers).
+        """
+        if self.owns(printer):
+            return self.queued_pages.get(printer, 0)
+        return self.remote_load.get(printer, (0, DEFAULT_SECONDS_PER_PAGE))[0]
+
+    def seconds_to_print(self, printer: str, pages: int) -> float:
+        return pages * self._seconds_per_page(printer)
+
+    def estimated_drain_seconds(self, printer: str) -> float:
+        """
+        Time for a printer to finish every job queued on it, from in-memory queue depth.
+        """
+        return self.seconds_to_print(printer, self.pending_pages(printer))
+
+    def estimate_completion(self, printer: str, pages: int, submitted_at: datetime) -> datetime:
+        """
+        When a job of `pages` pages submitted now should be done: the queue ahead of it, then the job itself.
+        """
+        seconds = self.estimated_drain_seconds(printer) + self.seconds_to_print(printer, pages)
+        return submitted_at + timedelta(seconds=seconds)
+
+    def pick_printer(self, printers: list):
+        """
+        The printer with the lowest estimated drain time, or None for an empty list.
+        """
+        return min(printers, key=self.estimated_drain_seconds, default=None)
+
+    def _enqueue(self, job: dict):
+        known = self.known_jobs.setdefault(job["printer"], set())
+        if job["_id"] in known:
+            return
+        known.add(job["_id"])
+        self.queued_pages[job["printer"]] = self.queued_pages.get(job["printer"], 0) + job["pages"]
+        queue = self.queues.setdefault(job["printer"], JobQueue())
+        queue.put_nowait(job)
+        PRINTER_QUEUE_DEPTH.labels(job["printer"]).set(queue.qsize())
+
+    def _record_throughput(self, printer: str, pages: int, elapsed: float):
+        if pages <= 0:
+            return
+        previous = self.seconds_per_page.get(printer, DEFAULT_SECONDS_PER_PAGE)
+        self.seconds_per_page[printer] = (1 - THROUGHPUT_SMOOTHING) * previous + THROUGHPUT_SMOOTHING * elapsed / pages
+
+    # Leases
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await self._heartbeat_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Scheduler heartbeat failed")
+
+    async def _heartbeat_once(self):
+        db = get_database()
+        async for printer in db["printers"].find({}, {"_id": 0, "name": 1}):
+            name = printer["name"]
+            if await self._acquire_lease(db, name):
+                if name not in self.workers:
+                    await self._take_over(db, name)
+                else:
+                    await self._sweep(db, name)
+            elif name in self.workers:
+                logger.warning("Lost printer lease", extra={"printer": name})
+                self.workers.pop(name).cancel()
+                PRINTER_QUEUE_DEPTH.labels(name).set(0)
+                self.queues.pop(name, None)
+                self.known_jobs.pop(name, None)
+                self.queued_pages.pop(name, None)
+        self.remote_load = {
+            lease["_id"]: (lease.get("queuedPages", 0), lease.get("secondsPerPage", DEFAULT_SECONDS_PER_PAGE))
+            async for lease in db["printer_leases"].find({"owner": {"$ne": self.instance_id}})
+        }
+
+    async def _acquire_lease(self, db, printer: str) -> bool:
+        """
+        Renew our lease on a printer, or take it if it is free or expired.
+        The lease also carries the printer's load for the other processes.
+        """
+        now = datetime.now(timezone.utc)
+        try:
+            lease = await db["printer_leases"].find_one_and_update(
+                {"_id": printer, "$or": [{"owner": self.instance_id}, {"expiresAt": {"$lt": now}}]},
+                {"$set": {"owner": self.instance_id, "expiresAt": now + timedelta(seconds=LEASE_TTL_SECONDS),
+                          "queuedPages": self.queued_pages.get(printer, 0),
+                          "secondsPerPage": self._seconds_per_page(printer)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Lease exists and is held by a live owner
+            return False
+        return lease is not None and lease["owner"] == self.instance_id
+
+    async def _take_over(self, db, printer: str):
+        """
+        Become the owner of a printer: recover jobs orphaned by a previous owner and rebuild the queue.
+        """
+        await db["waiting_sessions"].update_many(
+            {"printer": printer, "status": "PRINTING", "claimedBy": {"$ne": self.instance_id}},
+            {"$set": {"status": "WAITING"}, "$unset": {"claimedBy": ""}}
+        )
+        # Cancelled jobs used to be removed lazily by the worker; drop leftovers now
+        await db["waiting_sessions"].delete_many({"printer": printer, "status": "CANCELLED"})
+        self.queues[printer] = JobQueue()
+        self.known_jobs[printer] = set()
+        self.queued_pages[printer] = 0
+        await self._sweep(db, printer)
+        self.workers[printer] = asyncio.create_task(self._process_printer_queue(printer))
+
+    async def _sweep(self, db, printer: str):
+        """
+        Enqueue WAITING jobs submitted through other processes.
+        """
+        async for job in db["waiting_sessions"].find({"printer": printer, "status": "WAITING"}).sort("_id", 1):
+            self._enqueue(job)
+
+    # Workers
+
+    async def _claim(self, db, waiting_job: dict):
+        return await db["waiting_sessions"].find_one_and_update(
+            {"_id": waiting_job["_id"], "status": "WAITING"},
+            {"$set": {"status": "PRINTING", "claimedBy": self.instance_id}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _next_run(self, queue: JobQueue, first: dict) -> list:
+        """
+        The jobs to print in one run: `first`, plus the coalescible jobs queued right behind it.
+        """
+        run = [first]
+        if not COALESCE_JOBS:
+            return run
+        while (job := queue.peek()) is not None and job["_id"] not in self.cancelled and can_coalesce(run, job):
+            run.append(queue.get_nowait())
+        return run
+
+    async def _process_printer_queue(self, printer: str):
+        """
+        Worker draining one printer's queue for as long as this process holds its lease.
+        """
+        queue = self.queues[printer]
+        known = self.known_jobs[printer]
+        db = get_database()
+        while True:
+            batch = self._next_run(queue, await queue.get())
+            PRINTER_QUEUE_DEPTH.labels(printer).set(queue.qsize())
+            run, retry = [], []
+            try:
+                for waiting_job in batch:
+                    if waiting_job["_id"] in self.cancelled:
+                        await self._discard(db, printer, waiting_job)
+                        continue
+                    waiting_job = await self._claim(db, waiting_job) or waiting_job
+                    if waiting_job.get("claimedBy") != self.instance_id:
+                        # Cancelled or already claimed elsewhere
+                        await self._discard(db, printer, waiting_job)
+                        continue
+                    event_bus.job_changed(waiting_job)
+                    submitted_at = _as_utc(waiting_job.get("submission_time"))
+                    if isinstance(submitted_at, datetime):
+                        PRINT_JOB_WAIT.labels(printer).observe((now_utc() - submitted_at).total_seconds())
+                    run.append(waiting_job)
+                if not run:
+                    continue
+
+                # Mark the printer as busy; new jobs keep queueing behind this run
+                await printer_cache.set_busy(db, printer, True)
+                pages = sum(waiting_job["pages"] for waiting_job in run)
+                logger.info("Processing job", extra={"printer": printer, "fileId": run[0]["fileId"],
+                                                     "pages": pages, "jobs": len(run)})
+                started = time.monotonic()
+                try:
+                    await self.driver.print_job(printer, run[0] if len(run) == 1 else self._run_job(run))
+                finally:
+                    PRINT_JOB_DURATION.labels(printer).observe(time.monotonic() - started)
+                elapsed = time.monotonic() - started
+                completed = await self._complete(db, [waiting_job for waiting_job in run
+                                                      if waiting_job["_id"] not in self.cancelled])
+                for waiting_job in run:
+                    if waiting_job["_id"] not in completed:
+                        await self._discard(db, printer, waiting_job)
+                        continue
+                    PRINT_JOBS.labels(printer, "completed").inc()
+                self._record_throughput(printer, pages, elapsed)
+                logger.info("Completed job", extra={"printer": printer, "fileId": run[0]["fileId"],
+                                                    "jobs": len(run), "seconds": round(elapsed, 3)})
+            except asyncio.CancelledError:
+                raise
+            except PrinterJam as e:
+                PRINT_JOBS.labels(printer, "jammed").inc()
+                logger.warning("Printer jammed, requeueing job", extra={"printer": printer,
+                                                                        "fileId": run[0]["fileId"],
+                                                                        "jobs": len(run), "error": str(e)})
+                retry = await self._requeue_run(db, printer, run)
+            except Exception:
+                PRINT_JOBS.labels(printer, "failed").inc()
+                logger.exception("Error processing job", extra={"printer": printer, "fileId": batch[0].get("fileId")})
+                try:
+                    # Give back the claims, or the jobs would stay PRINTING with nobody printing them
+                    retry = await self._requeue_run(db, printer, run)
+                except Exception:
+                    logger.exception("Could not requeue jobs", extra={"printer": printer, "jobs": len(run)})
+            finally:
+                for waiting_job in batch:
+                    known.discard(waiting_job["_id"])
+                    self.queued_pages[printer] = max(0, self.queued_pages.get(printer, 0) - waiting_job["pages"])
+                    queue.task_done()
+                for waiting_job in retry:
+                    self._enqueue(waiting_job)
+                if queue.empty():
+                    # No jobs left in the queue, the printer is idle
+                    await printer_cache.set_busy(db, printer, False)
+
+    @staticmethod
+    def _run_job(run: list) -> dict:
+        """
+        What the driver is asked to print for a coalesced run: one job covering every page.
+        """
+        return {"fileId": run[0]["fileId"], "studentId": run[0]["studentId"],
+                "pages": sum(waiting_job["pages"] for waiting_job in run),
+                "duplex": run[0].get("duplex", False), "jobs": run}
+
+    async def _discard(self, db, printer: str, waiting_job: dict):
+        logger.info("Skipping cancelled job", extra={"printer": printer, "fileId": waiting_job["fileId"]})
+        PRINT_JOBS.labels(printer, "cancelled").inc()
+        self.cancelled.discard(waiting_job["_id"])
+        result = await db["waiting_sessions"].delete_one({"_id": waiting_job["_id"], "status": "CANCELLED"})
+        if result.deleted_count and waiting_job.get("documentHash"):
+            # The job never reaches history, so it no longer references its file
+            await release_document(db, get_gridfs(), waiting_job["documentHash"])
+
+    async def _requeue(self, db, waiting_job: dict) -> bool:
+        """
+        Release the claim on a job that failed part-way so it is printed again.
+        """
+        result = await db["waiting_sessions"].update_one(
+            {"_id": waiting_job["_id"], "status": "PRINTING", "claimedBy": self.instance_id},
+            {"$set": {"status": "WAITING"}, "$unset": {"claimedBy": ""}}
+        )
+        if result.modified_count == 0:
+            return False
+        waiting_job["status"] = "WAITING"
+        waiting_job.pop("claimedBy", None)
+        event_bus.job_changed(waiting_job)
+        return True
+
+    async def _requeue_run(self, db, printer: str, run: list) -> list:
+        """
+        Requeue the claimed jobs of a failed run; returns those to enqueue again.
+        """
+        retry = []
+        for waiting_job in run:
+            if await self._requeue(db, waiting_job):
+                retry.append(waiting_job)
+                continue
+            # Without a transaction the run can fail after marking a job COMPLETE but before its history
+            completed = await db["waiting_sessions"].find_one(
+                {"_id": waiting_job["_id"], "status": "COMPLETE", "claimedBy": self.instance_id},
+                {"completion_time": 1}
+            )
+            if completed:
+                await self._record_completion(db, printer, waiting_job, _as_utc(completed["completion_time"]))
+            else:
+                await self._discard(db, printer, waiting_job)
+        return retry
+
+    async def _record_completion(self, db, printer: str, waiting_job: dict, completed_at: datetime):
+        """
+        Write the history of a job left COMPLETE by a failed run. write_history
+        skips rows already stored, so this is safe if part of it got through.
+        """
+        logger.warning("Recording history of a job completed before its run failed",
+                       extra={"printer": printer, "fileId": waiting_job["fileId"]})
+        if self.history.enabled:
+            self.history.add(waiting_job, completed_at)
+        else:
+            await write_history(db, [(waiting_job, completed_at)])
+        PRINT_JOBS.labels(printer, "completed").inc()
+        event_bus.job_changed(waiting_job, status="COMPLETE", completion_time=completed_at)
+
+    async def _complete(self, db, jobs: list) -> set:
+        """
+        Mark the jobs of a run COMPLETE and record them in history, as one
+        transaction when the deployment supports it. Returns the _ids completed;
+        jobs no longer claimed by this process (e.g. cancelled) are left alone.
+        """
+        if not jobs:
+            return set()
+        completed_at = now_utc()
+
+        async def complete(session=None):
+            done = []
+            for waiting_job in jobs:
+                # Only the process still holding the claim may complete the job
+                result = await db["waiting_sessions"].update_one(
+                    {"_id": waiting_job["_id"], "status": "PRINTING", "claimedBy": self.instance_id},
+                    {"$set": {"status": "COMPLETE", "completion_time": completed_at}},
+                    session=session
+                )
+                if result.modified_count:
+                    done.append(waiting_job)
+            if not self.history.enabled:
+                await write_history(db, [(waiting_job, completed_at) for waiting_job in done], session=session)
+            return done
+
+        if supports_transactions():
+            async with get_client().start_session() as session:
+                done = await session.with_transaction(complete)
+        else:
+            done = await complete()
+        for waiting_job in done:
+            if self.history.enabled:
+                self.history.add(waiting_job, completed_at)
+            event_bus.job_changed(waiting_job, status="COMPLETE", completion_time=completed_at)
+        return {waiting_job["_id"] for waiting_job in done}
+
+
+printer_scheduler = PrinterScheduler()
@@ -4,7 +4,12 @@ from enum import Enum
 from datetime import datetime
 from pydantic import BaseModel, Field
 from bson import ObjectId as BsonObjectId
-from typing import Optional
+from typing import Optional, Annotated
+from pydantic import BeforeValidator
+from utils import format_time
+
+# Stored as a BSON datetime, returned in the UTC+7 display format
+DisplayTime = Annotated[str, BeforeValidator(format_time)]
 
         
 class StatusEnum(str, Enum):
@@ -23,7 +28,7 @@ class PersonalInfo(BaseModel):
     numberOfPrintedDocs: int
 
 class PrintHistory(BaseModel):
-    time: str
+    time: DisplayTime
     fileName: str
     pages: int
     printer: str
@@ -32,8 +37,8 @@ class PrintHistory(BaseModel):
 
 class WaitingSession(BaseModel):
     fileId: Optional[str]
-    time: Optional[str]
-    expected_time: Optional[str]
+    time: Optional[DisplayTime]
+    expected_time: Optional[DisplayTime]
     studentName: str
     studentId: str
     fileName: str
@@ -43,11 +48,11 @@ class WaitingSession(BaseModel):
     copies: int
     area: str
     status: str
-    submission_time: str
-    completion_time: Optional[str]
+    submission_time: DisplayTime
+    completion_time: Optional[DisplayTime]
 
 class Transaction(BaseModel):
-    time: str
+    time: DisplayTime
     transaction_id: str
     title: str
     payment: str
@@ -96,7 +101,7 @@ class DeleteSessionRequest(BaseModel):
 
 class PrintingHistory(BaseModel):
     docName: str
-    printTime: str
+    printTime: DisplayTime
     studentName: str
     copies: int
     printer: str
@@ -0,0 +1,75 @@
+"""
+Read-through cache of student profiles, keyed by studentId.
+
+Profiles are read on most user actions, often several times per action. The
+cache is a bounded LRU whose entries also expire after a TTL, which bounds how
+long a change made by another process can go unseen. Writes to a student's
+balance in this process replace the cached entry with the updated document.
+The balance check that authorizes a print job is itself a conditional update
+in MongoDB, so it never relies on a cached balance.
+"""
+import os
+import time
+from collections import OrderedDict
+
+STUDENT_CACHE_SIZE = int(os.getenv("STUDENT_CACHE_SIZE", "1024"))
+STUDENT_CACHE_TTL_SECONDS = float(os.getenv("STUDENT_CACHE_TTL_SECONDS", "30"))
+
+
+class StudentCache:
+    def __init__(self, maxsize: int = STUDENT_CACHE_SIZE, ttl: float = STUDENT_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, db, student_id: str):
+        """
+        The student's profile, from the cache or else from MongoDB. None if there is no such student.
+        """
+        entry = self.entries.get(student_id)
+        if entry is not None:
+            expires_at, student = entry
+            if expires_at > time.monotonic():
+                self.hits += 1
+                self.entries.move_to_end(student_id)
+                return dict(student)
+            del self.entries[student_id]
+        self.misses += 1
+        student = await db["students"].find_one({"studentId": student_id})
+        if student is not None:
+            self.put(student)
+        return student
+
+    def put(self, student: dict):
+        if self.maxsize <= 0:
+            return
+        student_id = student["studentId"]
+        self.entries[student_id] = (time.monotonic() + self.ttl, dict(student))
+        self.entries.move_to_end(student_id)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, student_id: str):
+        self.entries.pop(student_id, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "ttlSeconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+student_cache = StudentCache()
@@ -0,0 +1,39 @@
+"""
+Integration tests against a real MongoDB.
+
+The tests run against TEST_MONGO_URI (default mongodb://localhost:27017), each
+in a throwaway database that is dropped afterwards. When no server answers
+there, they are skipped. Point TEST_MONGO_URI at a replica set to exercise the
+transactional paths.
+"""
+import os
+import sys
+import uuid
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.join(ROOT, "benchmarks")
+sys.path[:0] = [ROOT, BENCHMARKS]
+
+TEST_MONGO_URI = os.getenv("TEST_MONGO_URI", "mongodb://localhost:27017")
+
+
+@pytest.fixture
+def mongo():
+    """
+    (uri, database name) of a scratch database, dropped after the test.
+    """
+    client = MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        client.close()
+        pytest.skip(f"No MongoDB at {TEST_MONGO_URI}: {e}")
+    name = f"spso_test_{uuid.uuid4().hex[:12]}"
+    try:
+        yield TEST_MONGO_URI, name
+    finally:
+        client.drop_database(name)
+        client.close()
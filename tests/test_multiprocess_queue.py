@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+from conftest import BENCHMARKS
+
+
+def test_every_accepted_job_is_printed_exactly_once(mongo):
+    # Several API processes share the queue; one is killed so its printer leases are taken over
+    uri, name = mongo
+    result = subprocess.run(
+        [sys.executable, os.path.join(BENCHMARKS, "multiprocess_queue.py"),
+         "--processes", "2", "--jobs", "30", "--base-port", "8150"],
+        env=dict(os.environ, MONGO_URI=uri, DATABASE_NAME=name),
+        capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
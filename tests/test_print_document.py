@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+
+import database
+import routers.user
+from bench_print_document import STUDENT_ID, atomic_submit, make_job, run_mode
+from routers.user import deduct_pages_and_queue
+
+
+@pytest.fixture
+def db(mongo, monkeypatch):
+    uri, name = mongo
+    monkeypatch.setattr(database, "MONGO_URI", uri)
+    monkeypatch.setattr(database, "DATABASE_NAME", name)
+
+
+def run_with_database(coroutine_function):
+    async def run():
+        db = await database.connect_to_database()
+        try:
+            return await coroutine_function(db)
+        finally:
+            await database.close_database_connection()
+    return asyncio.run(run())
+
+
+def test_concurrent_submissions_never_overdraw(db):
+    result = run_with_database(lambda db: run_mode(db, "atomic", atomic_submit, jobs=100, affordable=20))
+    assert not result["overdrawn"]
+    assert result["accepted"] == result["queued"] == 20
+    assert result["final_balance"] == 0
+
+
+def test_failed_document_reference_leaves_no_job(db, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise RuntimeError("reference failed")
+    monkeypatch.setattr(routers.user, "reference_document", fail)
+
+    async def submit(db):
+        await db["students"].insert_one({"name": "Test", "studentId": STUDENT_ID, "numberOfA4": 10,
+                                         "numberOfPrintedDocs": 0})
+        with pytest.raises(RuntimeError):
+            await deduct_pages_and_queue(db, STUDENT_ID, 4, 1, {**make_job(), "documentHash": "0" * 64})
+        return (await db["students"].find_one({"studentId": STUDENT_ID}),
+                await db["waiting_sessions"].count_documents({}))
+
+    student, jobs = run_with_database(submit)
+    assert jobs == 0
+    assert student["numberOfA4"] == 10
+    assert student["numberOfPrintedDocs"] == 0
@@ -1,7 +1,81 @@
 from fastapi import Request, HTTPException
+from datetime import datetime, timezone
+import pytz
+
+# Define the UTC+7 timezone
+timezone_utc_plus_7 = pytz.timezone('Asia/Bangkok')
+# Format the API has always used to display times (in UTC+7)
+DISPLAY_TIME_FORMAT = '%I:%M%p %d/%m/%Y'
+
+def now_utc():
+    """
+    Current time for a stored timestamp. Take it per event; Mongo keeps it as a BSON datetime.
+    """
+    return datetime.now(timezone.utc)
+
+def format_time(value):
+    """
+    Render a stored timestamp in UTC+7 with the display format. Strings written
+    before the datetime migration are passed through unchanged.
+    """
+    if not isinstance(value, datetime):
+        return value
+    if value.tzinfo is None:
+        # pymongo returns naive datetimes in UTC
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone_utc_plus_7).strftime(DISPLAY_TIME_FORMAT)
+
+def localize_query_time(value):
+    """
+    Read a datetime from a query parameter. Naive values are taken in UTC+7,
+    the zone every time is displayed in; aware values and None pass through.
+    """
+    if value is None or value.tzinfo is not None:
+        return value
+    return timezone_utc_plus_7.localize(value)
+
+def parse_display_time(value: str):
+    """
+    Parse a legacy display-format string (UTC+7) into a UTC datetime.
+    """
+    local = timezone_utc_plus_7.localize(datetime.strptime(value, DISPLAY_TIME_FORMAT))
+    return local.astimezone(timezone.utc)
 
 def get_student_id_from_header(request: Request):
     student_id = request.headers.get("studentId")
     if not student_id:
         raise HTTPException(status_code=400, detail="Missing studentId in headers")
     return student_id
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def parse_byte_range(range_header: str, length: int):
+    """
+    Parse a single "bytes=start-end" range against a resource of `length` bytes.
+    Returns (start, end) inclusive, or None when the header should be ignored
+    (malformed or multiple ranges). Raises ValueError when it is unsatisfiable.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    if first == "":
+        # Suffix range: the last N bytes
+        if not last.isdigit():
+            return None
+        if int(last) == 0:
+            raise ValueError("Empty suffix range")
+        return max(length - int(last), 0), length - 1
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+    start = int(first)
+    end = int(last) if last else length - 1
+    if start >= length or end < start:
+        raise ValueError("Unsatisfiable range")
+    return start, min(end, length - 1)